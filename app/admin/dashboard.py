@@ -1,14 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
-from typing import List
+from typing import List, Optional
 
-from app.database import get_async_session
+from app.database import async_session_maker, get_async_session
 from app.models.user import User
-from app.models.chat import ChatHistory
 from app.services.auth import current_active_user
-from app.schemas.chat import ChatHistoryWithMessages # You would need to create this schema
+from app.services.answer_cache import get_answer_cache_stats
+from app.services.chat_export import InvalidCursor, fetch_message_page, stream_messages
+from app.services.analytics import get_clinic_rollups
+from app.schemas.chat import ChatMessagePage
+from app.schemas.analytics import ClinicStatsBucket
 
 router = APIRouter()
 
@@ -21,26 +25,69 @@ async def get_current_active_superuser(user: User = Depends(current_active_user)
         )
     return user
 
-@router.get("/chat_history/{clinic_id}", response_model=List[ChatHistoryWithMessages])
+@router.get("/chat_history/{clinic_id}", response_model=ChatMessagePage)
 async def get_chat_history_for_clinic(
     clinic_id: int,
+    cursor: Optional[str] = Query(None, description="`next_cursor` of the previous page"),
+    limit: int = Query(50, ge=1, le=500),
+    phone: Optional[str] = Query(None, description="Only this customer's conversation"),
+    since: Optional[datetime.datetime] = Query(None, description="Messages at or after this time (UTC)"),
+    until: Optional[datetime.datetime] = Query(None, description="Messages before this time (UTC)"),
     session: AsyncSession = Depends(get_async_session),
     user: User = Depends(get_current_active_superuser), # Protect this endpoint
 ):
     """
-    Admin endpoint to view all chat histories for a specific clinic.
-    Only accessible by superusers.
+    Admin endpoint to browse the chat messages of a specific clinic, newest first.
+    Results are paginated with an opaque cursor; only accessible by superusers.
     """
-    stmt = select(ChatHistory).where(ChatHistory.clinic_id == clinic_id).options(
-        selectinload(ChatHistory.messages)
+    try:
+        return await fetch_message_page(session, clinic_id, limit, cursor, phone, since, until)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.get("/chat_history/{clinic_id}/export")
+async def export_chat_history_for_clinic(
+    clinic_id: int,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    phone: Optional[str] = None,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    user: User = Depends(get_current_active_superuser),
+):
+    """
+    Admin endpoint to export a clinic's chat messages (oldest first) as NDJSON or CSV.
+    The response is streamed from a server-side cursor, so any amount of history can be exported.
+    """
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    filename = f"clinic_{clinic_id}_chat_history.{format}"
+    return StreamingResponse(
+        stream_messages(async_session_maker, format, clinic_id, phone, since, until),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
-    result = await session.execute(stmt)
-    histories = result.scalars().all()
-    
-    if not histories:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"No chat history found for clinic ID {clinic_id}",
-        )
-        
-    return histories
\ No newline at end of file
+
+@router.get("/answer_cache/{clinic_id}")
+async def get_answer_cache_metrics(
+    clinic_id: int,
+    user: User = Depends(get_current_active_superuser),
+):
+    """
+    Admin endpoint to view the semantic answer cache hit rate and LLM time saved for a clinic.
+    """
+    return await run_in_threadpool(get_answer_cache_stats, clinic_id)
+
+@router.get("/analytics/{clinic_id}", response_model=List[ClinicStatsBucket])
+async def get_clinic_analytics(
+    clinic_id: int,
+    granularity: str = Query("day", pattern="^(hour|day)$"),
+    since: Optional[datetime.datetime] = Query(None, description="First bucket (UTC)"),
+    until: Optional[datetime.datetime] = Query(None, description="End of the range, exclusive (UTC)"),
+    session: AsyncSession = Depends(get_async_session),
+    user: User = Depends(get_current_active_superuser),
+):
+    """
+    Admin endpoint for per-clinic conversation analytics: messages, unique patients, average
+    reply latency and tokens spent per hour or day. Served from incrementally maintained
+    rollups, so it never scans the message table.
+    """
+    return await get_clinic_rollups(session, clinic_id, granularity, since, until)
@@ -1,15 +1,46 @@
-import asyncio
+import datetime
+import os
+import threading
+import time
+from dataclasses import asdict
+from typing import Optional
+
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
 from loguru import logger
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine
 
 from app.config import settings
-from app.services.ai_engine import get_ai_response
+from app.background.runtime import get_session_maker, run_async, start_worker_loop, stop_worker_loop
+from app.background.sharding import enqueue_conversation_turn
+from app.background.checkpoints import TurnCheckpoint
+from app.services.ai_engine import (
+    CLINIC_UNAVAILABLE_MESSAGE,
+    GeneratedReply,
+    TurnContext,
+    build_turn_context,
+    generate_reply,
+)
 from app.services.whatsapp import send_whatsapp_message
-from app.services.vectorstore import embed_and_store_document
-from app.models.clinic import Clinic
-from app.models.chat import ChatHistory, Message
+from app.services.vectorstore import chunk_hash, embed_and_store_text_stream
+from app.services.document_storage import delete_document, iter_document_text
+from app.services.document_manifest import (
+    delete_chunks,
+    document_lock,
+    load_chunk_hashes,
+    load_manifest,
+    save_chunks,
+    save_manifest,
+)
+from app.services.clinic_versions import bump_clinic_version
+from app.services.history import summarize_older_messages
+from app.services.clinic_routing import clinic_router
+from app.services.coalescer import merge_burst, rescue_overdue_bursts, take_burst_if_ready
+from app.services.persistence import init_message_buffer, upsert_chat_history
+from app.services.analytics import TurnStats
+from app.services.warmup import warm_up_clients
+from app.services.metrics import QUEUE_WAIT, STAGE_LATENCY, clinic_label, mark_process_dead, track_stage
 
 # Setup Celery App
 celery_app = Celery("tasks", broker=settings.REDIS_URL, backend=settings.REDIS_URL)
@@ -20,48 +51,118 @@ celery_app = Celery("tasks", broker=settings.REDIS_URL, backend=settings.REDIS_U
 sync_engine = create_engine(settings.DATABASE_URL.replace("+asyncpg", "+psycopg2"))
 SyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=sync_engine)
 
-@celery_app.task(name="process_whatsapp_message", autoretry_for=(Exception,), retry_kwargs={'max_retries': 3, 'countdown': 5})
-def process_whatsapp_message(message_data: dict):
+# Write-behind buffer for chat messages (bulk inserts, flushed on size/time and on shutdown)
+message_buffer = init_message_buffer(SyncSessionLocal)
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """
+    Starts the persistent event loop once per worker process (after fork), warms
+    up the lazily created clients in the background, and starts the message buffer's
+    flush thread, which also writes rows spilled by earlier workers.
+    """
+    start_worker_loop()
+    message_buffer.start()
+    if settings.WARM_UP_CLIENTS:
+        threading.Thread(target=warm_up_clients, name="client-warmup", daemon=True).start()
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    message_buffer.close()
+    stop_worker_loop()
+    mark_process_dead(os.getpid())
+
+
+@celery_app.task(name="process_whatsapp_message", bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3, 'countdown': 5})
+def process_whatsapp_message(self, message_data: dict):
     """
     Celery task to process an incoming WhatsApp message.
     It fetches clinic info, gets an AI response, sends a reply, and logs the conversation.
+    With conversation sharding enabled it is always enqueued on the conversation's shard queue.
+
+    The pipeline runs in checkpointed stages (context retrieval -> generation -> delivery ->
+    persistence), so a retry resumes at the stage that failed.
     """
     customer_phone = message_data['From']
     clinic_phone = message_data['To'] # The clinic's WhatsApp number
     user_message = message_data['Body']
+    checkpoint = TurnCheckpoint(self.request.id)
+    turn_started = time.perf_counter()
     
     db = SyncSessionLocal()
     try:
-        # 1. Find the clinic associated with the 'To' number.
-        # This is a simplification. A real app would have a mapping of Twilio numbers to clinics.
-        # For now, we'll assume one clinic for demonstration.
-        clinic = db.query(Clinic).first()
-        if not clinic:
+        # 1. Find the clinic associated with the 'To' number (cached, see clinic_routing).
+        with track_stage("routing"):
+            clinic_id = clinic_router.resolve(db, clinic_phone)
+        if clinic_id is None:
             logger.error(f"No clinic found for number {clinic_phone}. Cannot process message.")
             return
+        if message_data.get("enqueued_at") and self.request.retries == 0:
+            QUEUE_WAIT.labels(clinic_label(clinic_id)).observe(max(0.0, time.time() - message_data["enqueued_at"]))
+
+        # 2. Context retrieval: clinic profile, history and RAG, assembled into the prompt.
+        # We need to run the async pipeline from this synchronous Celery task, on the
+        # worker's persistent event loop.
+        saved_context = checkpoint.load("context")
+        if saved_context is None:
+            received_at = datetime.datetime.utcnow()
+            with track_stage("context", clinic_id):
+                context = run_async(run_async_build_turn_context(clinic_id, customer_phone, user_message))
+            if context is None:
+                send_whatsapp_message(to=customer_phone, body=CLINIC_UNAVAILABLE_MESSAGE, from_=clinic_phone)
+                return
+            checkpoint.save("context", {"turn": context.to_dict(), "received_at": received_at.isoformat()})
+        else:
+            context = TurnContext.from_dict(saved_context["turn"])
+            received_at = datetime.datetime.fromisoformat(saved_context["received_at"])
+
+        # 3. Generation: the (paid) LLM call, done at most once per turn.
+        saved_reply = checkpoint.load("reply")
+        if saved_reply is None:
+            with track_stage("generation", clinic_id):
+                reply = run_async(generate_reply(context))
+            checkpoint.save("reply", asdict(reply))
+        else:
+            reply = GeneratedReply(**saved_reply)
+        ai_message = reply.text
 
-        clinic_id = clinic.id
-
-        # 2. Get AI response. We need to run our async get_ai_response function
-        # from this synchronous Celery task.
-        ai_message = asyncio.run(run_async_get_ai_response(clinic_id, customer_phone, user_message))
-
-        # 3. Send reply via WhatsApp
-        send_whatsapp_message(to=customer_phone, body=ai_message)
-
-        # 4. Log the conversation to the database
-        chat_history = db.query(ChatHistory).filter_by(customer_phone=customer_phone, clinic_id=clinic_id).first()
-        if not chat_history:
-            chat_history = ChatHistory(customer_phone=customer_phone, clinic_id=clinic_id)
-            db.add(chat_history)
-            db.commit()
-            db.refresh(chat_history)
-        
-        # Add user message and assistant response
-        db.add(Message(content=user_message, role='user', chat_history_id=chat_history.id))
-        db.add(Message(content=ai_message, role='assistant', chat_history_id=chat_history.id))
-        db.commit()
-        logger.info(f"Successfully processed and logged message for {customer_phone}")
+        # 4. Delivery: send reply via WhatsApp
+        delivered = checkpoint.load("delivered")
+        if delivered is None:
+            with track_stage("delivery", clinic_id):
+                message_sid = send_whatsapp_message(to=customer_phone, body=ai_message, from_=clinic_phone, clinic_id=clinic_id)
+            reply_seconds = (datetime.datetime.utcnow() - received_at).total_seconds()
+            delivered = {"sid": message_sid, "reply_seconds": reply_seconds}
+            checkpoint.save("delivered", delivered)
+
+        # 5. Persistence: upsert the conversation, buffer the messages for a bulk write.
+        # Buffered rows the worker can't write are spilled to Redis, not dropped (see
+        # app/services/persistence.py), so the checkpoint is saved once they are buffered.
+        if checkpoint.load("persisted") is None:
+            with track_stage("persistence", clinic_id):
+                chat_history_id = upsert_chat_history(db, clinic_id, customer_phone)
+                message_buffer.add(chat_history_id, 'user', user_message, received_at, clinic_id=clinic_id)
+                message_buffer.add(chat_history_id, 'assistant', ai_message, clinic_id=clinic_id)
+                message_buffer.record_turn(TurnStats(
+                    clinic_id=clinic_id,
+                    customer_phone=customer_phone,
+                    received_at=received_at,
+                    reply_seconds=delivered["reply_seconds"],
+                    prompt_tokens=reply.prompt_tokens,
+                    completion_tokens=reply.completion_tokens,
+                    from_cache=reply.from_cache,
+                    templated=reply.templated,
+                    failed=reply.failed,
+                ))
+            checkpoint.save("persisted", chat_history_id)
+            logger.info(f"Successfully processed and logged message for {customer_phone}")
+
+            if settings.HISTORY_SUMMARY_ENABLED:
+                summarize_chat_history.delay(chat_history_id)
+
+        STAGE_LATENCY.labels("turn", clinic_label(clinic_id)).observe(time.perf_counter() - turn_started)
 
     except Exception as e:
         logger.error(f"Error in Celery task for {customer_phone}: {e}")
@@ -70,18 +171,128 @@ def process_whatsapp_message(message_data: dict):
     finally:
         db.close()
 
-@celery_app.task(name="add_document_to_vectorstore")
-def add_document_to_vectorstore(content: str, filename: str, clinic_id: int):
+@celery_app.task(name="flush_message_burst")
+def flush_message_burst(burst_key: str):
+    """
+    Celery task that turns a burst of quick inbound messages into a single turn.
+    Reschedules itself until the conversation has been quiet long enough, and also
+    reschedules overdue bursts of other conversations whose flush was lost.
+    """
+    for overdue_key in rescue_overdue_bursts():
+        flush_message_burst.delay(overdue_key)
+    state = take_burst_if_ready(burst_key)
+    if not state.ready:
+        flush_message_burst.apply_async(args=[burst_key], countdown=state.delay)
+        return
+    if not state.messages:
+        return
+    if len(state.messages) > 1:
+        logger.info(f"Coalesced {len(state.messages)} messages into one turn for {burst_key}")
+    enqueue_conversation_turn(process_whatsapp_message, merge_burst(state.messages))
+
+def _ingest_document(task, pieces, filename: str, clinic_id: int) -> Optional[dict]:
     """
-    Celery task to trigger the embedding and storage of a document.
+    Ingests a document's text and reports progress through the task state so callers can poll it.
+    Re-uploads of a filename are indexed incrementally against the document's chunk manifest,
+    one at a time per (clinic, filename).
+    Chunk texts are stored for the keyword index as their vectors are upserted.
     """
-    embed_and_store_document(content, filename, clinic_id)
+    with document_lock(sync_engine, clinic_id, filename):
+        return _ingest_document_locked(task, pieces, filename, clinic_id)
+
+
+def _ingest_document_locked(task, pieces, filename: str, clinic_id: int) -> Optional[dict]:
+    def report_progress(stats):
+        task.update_state(state="PROGRESS", meta={
+            "filename": filename,
+            "chunks": stats.chunks,
+            "vectors_upserted": stats.vectors_upserted,
+            "chunks_per_second": round(stats.chunks_per_second, 1),
+        })
+
+    def store_chunks(chunks):
+        # Reused chunks are reported too; only store the texts that are missing.
+        missing = [(digest, chunk) for digest, chunk in ((chunk_hash(c), c) for c in chunks) if digest not in stored_hashes]
+        if not missing:
+            return
+        db = SyncSessionLocal()
+        try:
+            save_chunks(db, clinic_id, filename, missing)
+        finally:
+            db.close()
+        stored_hashes.update(digest for digest, _ in missing)
+
+    db = SyncSessionLocal()
+    try:
+        known_hashes = load_manifest(db, clinic_id, filename)
+        stored_hashes = load_chunk_hashes(db, clinic_id, filename)
+    finally:
+        db.close()
+    stored_before = len(stored_hashes)
+
+    stats = embed_and_store_text_stream(
+        pieces, filename, clinic_id, on_progress=report_progress, known_hashes=known_hashes, on_page=store_chunks
+    )
+    if stats is None:
+        return None
+
+    db = SyncSessionLocal()
+    try:
+        delete_chunks(db, clinic_id, filename, (known_hashes | stored_hashes) - stats.chunk_hashes)
+        save_manifest(db, clinic_id, filename, stats.chunk_hashes)
+    finally:
+        db.close()
+    # New document content can change answers, so drop cached ones (and rebuild the
+    # keyword index when texts of unchanged chunks were backfilled).
+    if stats.vectors_upserted or stats.vectors_deleted or len(stored_hashes) != stored_before:
+        bump_clinic_version(clinic_id)
+    return {
+        "filename": filename,
+        "chunks": stats.chunks,
+        "vectors_upserted": stats.vectors_upserted,
+        "chunks_reused": stats.chunks_reused,
+        "vectors_deleted": stats.vectors_deleted,
+        "seconds": round(stats.seconds, 3),
+        "chunks_per_second": round(stats.chunks_per_second, 1),
+    }
+
+@celery_app.task(name="add_document_to_vectorstore", bind=True)
+def add_document_to_vectorstore(self, content: str, filename: str, clinic_id: int):
+    """
+    Celery task to trigger the embedding and storage of a document passed inline.
+    Prefer `add_stored_document_to_vectorstore`, which keeps the body out of the broker.
+    """
+    return _ingest_document(self, [content], filename, clinic_id)
+
+@celery_app.task(name="add_stored_document_to_vectorstore", bind=True)
+def add_stored_document_to_vectorstore(self, storage_key: str, filename: str, clinic_id: int):
+    """
+    Celery task to embed and store an uploaded document from document storage.
+    The file is read and split incrementally. It is deleted afterwards whether or not
+    ingestion succeeded: the task is not retried, so a failed upload has to be sent again.
+    """
+    try:
+        return _ingest_document(self, iter_document_text(storage_key), filename, clinic_id)
+    finally:
+        delete_document(storage_key)
+
+
+@celery_app.task(name="summarize_chat_history")
+def summarize_chat_history(chat_history_id: int):
+    """
+    Celery task to fold older turns of a conversation into its rolling summary.
+    """
+    run_async(run_async_summarize_chat_history(chat_history_id))
+
+
+async def run_async_summarize_chat_history(chat_history_id: int) -> bool:
+    async with get_session_maker()() as session:
+        return await summarize_older_messages(session, chat_history_id)
 
 
-async def run_async_get_ai_response(clinic_id: int, customer_phone: str, user_message: str) -> str:
+async def run_async_build_turn_context(clinic_id: int, customer_phone: str, user_message: str) -> Optional[TurnContext]:
     """
-    Helper function to create an async session and call the async get_ai_response function.
+    Helper function to create an async session and build the context of a turn.
     """
-    from app.database import async_session_maker
-    async with async_session_maker() as session:
-        return await get_ai_response(session, clinic_id, customer_phone, user_message)
\ No newline at end of file
+    async with get_session_maker()() as session:
+        return await build_turn_context(session, clinic_id, customer_phone, user_message)
@@ -0,0 +1,32 @@
+import json
+from typing import Any, Optional
+
+from app.config import settings
+from app.services.redis_client import get_redis
+
+# Stage checkpoints for process_whatsapp_message.
+# Each completed stage (context -> reply -> delivered -> persisted) stores its result in a
+# Redis hash keyed by the Celery task id, which stays the same across retries. A retry
+# therefore resumes at the stage that failed instead of re-running retrieval and the
+# paid LLM call, and a reply that was already delivered is never sent twice.
+
+
+class TurnCheckpoint:
+    def __init__(self, turn_id: str):
+        self.key = f"turn:{turn_id}"
+        self._stages: Optional[dict] = None
+
+    def load(self, stage: str) -> Optional[Any]:
+        # All stages are read with a single HGETALL on first access.
+        if self._stages is None:
+            raw = get_redis().hgetall(self.key)
+            self._stages = {k.decode(): json.loads(v) for k, v in raw.items()}
+        return self._stages.get(stage)
+
+    def save(self, stage: str, value: Any):
+        if self._stages is not None:
+            self._stages[stage] = value
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.hset(self.key, stage, json.dumps(value))
+        pipe.expire(self.key, settings.TURN_CHECKPOINT_TTL_SECONDS)
+        pipe.execute()
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+from typing import Any, Coroutine, Optional
+
+import aiohttp
+import openai
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+
+from app.config import settings
+
+# Per-process async runtime for Celery workers.
+# Instead of calling asyncio.run() for every task (which creates a new event loop,
+# orphans pooled DB connections and rebuilds the OpenAI HTTP session each time),
+# each worker process keeps one long-lived event loop on a dedicated thread,
+# together with its own async engine and HTTP session bound to that loop.
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[threading.Thread] = None
+_engine: Optional[AsyncEngine] = None
+_session_maker: Optional[async_sessionmaker] = None
+_http_session: Optional[aiohttp.ClientSession] = None
+_lock = threading.Lock()
+
+
+async def _open_clients():
+    """
+    Creates the loop-bound clients. Must run on the worker loop.
+    """
+    global _engine, _session_maker, _http_session
+    _engine = create_async_engine(
+        settings.DATABASE_URL,
+        pool_size=settings.WORKER_DB_POOL_SIZE,
+        pool_pre_ping=True,
+    )
+    _session_maker = async_sessionmaker(_engine, expire_on_commit=False)
+    _http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=settings.WORKER_HTTP_POOL_SIZE)
+    )
+
+
+async def _close_clients():
+    """
+    Closes the loop-bound clients. Must run on the worker loop.
+    """
+    global _engine, _session_maker, _http_session
+    if _http_session is not None:
+        await _http_session.close()
+    if _engine is not None:
+        await _engine.dispose()
+    _engine = None
+    _session_maker = None
+    _http_session = None
+
+
+def start_worker_loop():
+    """
+    Starts the long-lived event loop for this worker process.
+    Called once per process from the Celery `worker_process_init` signal.
+    """
+    global _loop, _loop_thread
+    with _lock:
+        if _loop is not None or not settings.WORKER_PERSISTENT_LOOP:
+            return
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, name="worker-event-loop", daemon=True)
+        thread.start()
+        asyncio.run_coroutine_threadsafe(_open_clients(), loop).result()
+        _loop, _loop_thread = loop, thread
+        logger.info("Persistent worker event loop started.")
+
+
+def stop_worker_loop():
+    """
+    Closes the clients and stops the worker event loop.
+    Called from the Celery `worker_process_shutdown` signal.
+    """
+    global _loop, _loop_thread
+    with _lock:
+        if _loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(_close_clients(), _loop).result(timeout=10)
+        except Exception as e:
+            logger.error(f"Failed to close worker clients cleanly: {e}")
+        _loop.call_soon_threadsafe(_loop.stop)
+        _loop_thread.join(timeout=10)
+        _loop.close()
+        _loop, _loop_thread = None, None
+        logger.info("Persistent worker event loop stopped.")
+
+
+def get_session_maker() -> async_sessionmaker:
+    """
+    Returns the session maker bound to the worker loop, or the application-wide one
+    when the persistent loop is not running (e.g. inside the API process).
+    """
+    if _session_maker is not None:
+        return _session_maker
+    from app.database import async_session_maker
+    return async_session_maker
+
+
+async def _with_worker_context(coro: Coroutine[Any, Any, Any]) -> Any:
+    # openai keeps its aiohttp session in a ContextVar, so it is set for every task.
+    if _http_session is not None:
+        openai.aiosession.set(_http_session)
+    return await coro
+
+
+def run_async(coro: Coroutine[Any, Any, Any]) -> Any:
+    """
+    Runs a coroutine from synchronous Celery code and returns its result.
+    Uses the persistent worker loop when enabled, otherwise falls back to asyncio.run().
+    """
+    if _loop is None:
+        # Pools that don't send `worker_process_init` (solo, threads) start the loop lazily.
+        start_worker_loop()
+    if _loop is None:
+        return asyncio.run(coro)
+    return asyncio.run_coroutine_threadsafe(_with_worker_context(coro), _loop).result()
@@ -0,0 +1,40 @@
+import time
+from typing import Optional
+
+from app.config import settings
+from app.utils.sharding import conversation_shard
+
+# Per-conversation ordering.
+# With CONVERSATION_SHARDS = N > 0, every turn of a (clinic, customer) conversation is
+# routed to the same queue "<CONVERSATION_QUEUE_PREFIX>.<i>" by consistent hashing.
+# Each shard queue must be consumed by exactly one worker process with concurrency 1:
+#
+#   celery -A app.background.tasks.celery_app worker -Q conversations.0 -c 1
+#   celery -A app.background.tasks.celery_app worker -Q conversations.1 -c 1
+#   ...
+#
+# Turns of one conversation then run strictly in order, while different conversations
+# run in parallel across shards. A turn that fails and is retried with a countdown is
+# re-queued on the same shard, but turns that arrived after it may complete first.
+
+
+def conversation_queue(message_data: dict) -> Optional[str]:
+    """
+    Returns the shard queue for a message, or None when sharding is disabled.
+    """
+    if settings.CONVERSATION_SHARDS <= 0:
+        return None
+    shard = conversation_shard(message_data["To"], message_data["From"], settings.CONVERSATION_SHARDS)
+    return f"{settings.CONVERSATION_QUEUE_PREFIX}.{shard}"
+
+
+def enqueue_conversation_turn(task, message_data: dict, **options):
+    """
+    Enqueues `task(message_data)` on the conversation's shard queue (or the default queue).
+    """
+    queue = conversation_queue(message_data)
+    # Stamped so the worker can measure how long the turn waited in the queue.
+    message_data = {**message_data, "enqueued_at": time.time()}
+    if queue:
+        options["queue"] = queue
+    return task.apply_async(args=[message_data], **options)
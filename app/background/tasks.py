@@ -0,0 +1,10 @@
+# Celery tasks live in the app.background package; this module is the entry point used by
+# the worker command (`celery -A app.background.tasks.celery_app worker`) and the routers.
+from app.background import (
+    celery_app,
+    process_whatsapp_message,
+    flush_message_burst,
+    add_document_to_vectorstore,
+    add_stored_document_to_vectorstore,
+    summarize_chat_history,
+)
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -12,16 +14,89 @@ class Settings(BaseSettings):
 
     # --- AI & Vector Store Settings ---
     OPENAI_API_KEY: str
-    PINECONE_API_KEY: str
-    PINECONE_ENVIRONMENT: str
+    VECTOR_BACKEND: str = "pinecone"  # "pinecone" or "numpy" (local, in-process index)
+    PINECONE_API_KEY: str = ""
+    PINECONE_ENVIRONMENT: str = ""
+    PINECONE_INDEX_NAME: str = "clinic-assistant-index"
+    LOCAL_VECTOR_DIR: str = "data/vectors"
+    EMBEDDING_DIMENSION: int = 1536  # Dimension for text-embedding-3-small
     EMBEDDING_MODEL: str = "text-embedding-3-small"
     CHAT_MODEL: str = "gpt-4-turbo"
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_SIZE: int = 2048  # In-process LRU entries per worker
+    EMBEDDING_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    PROMPT_TOKEN_BUDGET: int = 6000  # Whole prompt; trimmed history -> RAG -> services when exceeded
+    PROMPT_SERVICES_TOKEN_BUDGET: int = 1500
+    PROMPT_RAG_TOKEN_BUDGET: int = 1500
+    PROMPT_HISTORY_TOKEN_BUDGET: int = 2000
+    HISTORY_WINDOW_MESSAGES: int = 10  # Most recent messages sent to the LLM
+    HISTORY_SUMMARY_ENABLED: bool = False  # Keep a rolling summary of turns older than the window
+    HISTORY_SUMMARY_MIN_MESSAGES: int = 20  # Messages to accumulate before re-summarizing
+    HISTORY_SUMMARY_MAX_MESSAGES: int = 200
+    HISTORY_SUMMARY_MODEL: str = "gpt-3.5-turbo"
+    SEMANTIC_CACHE_ENABLED: bool = False  # Reuse answers to near-duplicate stand-alone questions
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95  # Minimum cosine similarity for a hit
+    SEMANTIC_CACHE_TTL_SECONDS: int = 3600
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 256  # Per clinic, per worker
+    SEMANTIC_CACHE_IDLE_SECONDS: int = 1800  # A turn after this much silence doesn't depend on history
+    HYBRID_RETRIEVAL_ENABLED: bool = True  # Fuse BM25 keyword matches with vector search results
+    LEXICAL_FASTPATH_ENABLED: bool = True  # Skip the embedding call when the keyword match is unambiguous
+    LEXICAL_FASTPATH_MAX_TERMS: int = 4  # Only short, keyword-style queries take the fast path
+    LEXICAL_FASTPATH_MIN_COVERAGE: float = 1.0  # Fraction of query terms the top match must contain
+    LEXICAL_FASTPATH_MIN_MARGIN: float = 1.5  # Top BM25 score over the runner-up's
+    RRF_K: int = 60  # Reciprocal rank fusion constant
+    LEXICAL_INDEX_MAX_CLINICS: int = 64  # Keyword indexes kept in memory per process
+    INTENT_FASTPATH_ENABLED: bool = True  # Answer simple service/price lookups from templates, without the LLM
+    INTENT_MAX_TOKENS: int = 12  # Longer messages always go to the LLM
+    INTENT_MAX_UNMATCHED_TOKENS: int = 0  # Other words a lookup may contain besides the service name, cues and filler
+    CLINIC_VERSION_POLL_SECONDS: float = 2.0
+    BLOCKING_IO_WORKERS: int = 16  # Threads for blocking embedding/index calls made from async code
+    INGEST_BATCH_SIZE: int = 64  # Chunks per embedding request
+    INGEST_BATCH_MAX_CHARS: int = 64000
+    INGEST_CONCURRENCY: int = 4  # Embedding requests in flight per document
+    INGEST_UPSERT_PAGE_SIZE: int = 100  # Vectors per index upsert
+    DOCUMENT_STORAGE_DIR: str = "data/documents"  # Uploaded documents awaiting ingestion; shared by API and workers
+    DOCUMENT_MAX_BYTES: int = 50 * 1024 * 1024
+    UPLOAD_OVERHEAD_BYTES: int = 64 * 1024  # Allowance for multipart/JSON framing on top of DOCUMENT_MAX_BYTES
 
     # --- WhatsApp Provider Settings (Twilio) ---
     TWILIO_ACCOUNT_SID: str
     TWILIO_AUTH_TOKEN: str
-    TWILIO_WHATSAPP_NUMBER: str
+    TWILIO_WHATSAPP_NUMBER: str  # Default sender when a clinic has no number of its own
+
+    CONVERSATION_SHARDS: int = 0  # >0 routes each conversation to one of N ordered shard queues
+    CONVERSATION_QUEUE_PREFIX: str = "conversations"
+
+    INBOUND_DEDUP_TTL_SECONDS: int = 24 * 3600  # How long a provider MessageSid is remembered
+
+    # --- Inbound Burst Coalescing ---
+    BURST_QUIET_SECONDS: float = 2.0  # Merge messages sent within this window of each other (0 disables)
+    BURST_MAX_WAIT_SECONDS: float = 8.0  # Never hold the first message of a burst longer than this
+    BURST_FLUSH_GRACE_SECONDS: int = 30  # A burst whose flush is this late is treated as lost and rescheduled
+
+    # --- Clinic Routing ---
+    ROUTING_CACHE_CHECK_SECONDS: float = 5.0  # How often workers check for routing changes
+    ROUTING_MISS_CACHE_SECONDS: float = 30.0  # How long an unknown number is remembered as unknown
+    DEFAULT_CLINIC_ID: Optional[int] = None  # Clinic for numbers that aren't mapped to any clinic
+
+    # --- Celery Worker Settings ---
+    WORKER_PERSISTENT_LOOP: bool = True  # Keep one event loop (and its connection pools) per worker process
+    WORKER_DB_POOL_SIZE: int = 5
+    WORKER_HTTP_POOL_SIZE: int = 20
+    TURN_CHECKPOINT_TTL_SECONDS: int = 3600  # How long stage results are kept for retries
+    MESSAGE_FLUSH_SIZE: int = 50  # Buffered message rows that trigger a bulk insert
+    MESSAGE_FLUSH_INTERVAL_SECONDS: float = 0.5  # Max time a message row stays buffered
+    MESSAGE_BUFFER_MAX_ROWS: int = 10000  # Oldest buffered rows are spilled to Redis beyond this while the database is down
+    MESSAGE_SPILL_REPLAY_INTERVAL_SECONDS: float = 10.0  # How often a worker takes spilled rows back
+    CHAT_HISTORY_ID_CACHE_SIZE: int = 100000
+    WARM_UP_CLIENTS: bool = True  # Create the OpenAI/vector index/Twilio clients in the background at startup
+
+    # --- Analytics ---
+    ANALYTICS_ROLLUPS_ENABLED: bool = True  # Maintain hourly/daily per-clinic aggregates as turns are persisted
 
     model_config = SettingsConfigDict(env_file=".env")
 
+# Built at import on purpose: it only reads the environment and .env (about 2.5 ms, no
+# network calls; see benchmarks/startup_time.py --offline), and the engines and the
+# Celery app are configured from it at import anyway, so a lazy accessor would save nothing.
 settings = Settings()
@@ -5,6 +5,7 @@ from fastapi_users_db_sqlalchemy import SQLAlchemyUserDatabase
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from app.config import settings
+from app.migrations import lock_schema, upgrade_schema
 from app.models.base import Base
 from app.models.user import User
 
@@ -19,8 +20,11 @@ async def create_db_and_tables():
     This is called on application startup.
     """
     async with engine.begin() as conn:
+        await lock_schema(conn)
         # await conn.run_sync(Base.metadata.drop_all) # Use for development to reset DB
         await conn.run_sync(Base.metadata.create_all)
+        # create_all doesn't alter existing tables; bring them up to date.
+        await upgrade_schema(conn)
 
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
@@ -1,14 +1,18 @@
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from loguru import logger
 
 from app.config import settings
 from app.database import create_db_and_tables
 from app.routers import auth, chat, clinic
 from app.admin import dashboard
+from app.services.metrics import render_metrics
+from app.services.warmup import warm_up_clients
+from app.utils.request_limits import BodySizeLimitMiddleware
 
 # Configure Loguru to intercept standard logging
 class InterceptHandler(logging.Handler):
@@ -22,11 +26,23 @@ class InterceptHandler(logging.Handler):
 logging.basicConfig(handlers=[InterceptHandler()], level=0, force=True)
 
 
+def _log_warm_up_result(task: asyncio.Task):
+    if task.cancelled():
+        logger.warning("Client warm-up was cancelled; clients will be created on first use.")
+    elif task.exception() is not None:
+        logger.opt(exception=task.exception()).error("Client warm-up failed; clients will be created on first use.")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # On startup
     logger.info("Starting up application...")
     logger.info(f"Connecting to database at {settings.DATABASE_URL}")
+    # Clients are created lazily; warm them up concurrently without delaying startup.
+    # The task is kept on app.state: the event loop only holds a weak reference to it.
+    if settings.WARM_UP_CLIENTS:
+        app.state.warm_up_task = asyncio.create_task(asyncio.to_thread(warm_up_clients))
+        app.state.warm_up_task.add_done_callback(_log_warm_up_result)
     await create_db_and_tables()
     logger.info("Database tables created.")
     yield
@@ -41,6 +57,17 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# --- Middleware ---
+# Oversized document uploads are rejected before their body is received.
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={
+        "/chat/documents/upload-file": settings.DOCUMENT_MAX_BYTES + settings.UPLOAD_OVERHEAD_BYTES,
+        # JSON escaping (\uXXXX) can make the body up to 6 bytes per byte of text.
+        "/chat/documents/upload": 6 * settings.DOCUMENT_MAX_BYTES + settings.UPLOAD_OVERHEAD_BYTES,
+    },
+)
+
 # --- Routers ---
 app.include_router(auth.router, prefix="/auth", tags=["Auth"])
 app.include_router(clinic.router, prefix="/clinic", tags=["Clinic Management"])
@@ -56,6 +83,16 @@ async def health_check():
     """
     return {"status": "ok"}
 
+# --- Metrics Endpoint ---
+@app.get("/metrics", tags=["Health"], include_in_schema=False)
+async def metrics():
+    """
+    Prometheus metrics: per-stage latency histograms, error counters, token counts,
+    cache hit rates and queue wait, labelled by clinic.
+    """
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 # --- Exception Handler ---
 @app.exception_handler(Exception)
 async def validation_exception_handler(request: Request, exc: Exception):
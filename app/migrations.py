@@ -0,0 +1,86 @@
+from typing import List
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# Schema changes to existing tables.
+# `Base.metadata.create_all` only creates missing tables; columns, constraints and indexes
+# added to tables that already exist are applied by the statements below at startup.
+# Every statement must be idempotent (it runs on every start) and a single SQL statement
+# (asyncpg can't prepare several at once; use a DO block for multi-step changes).
+# Startup takes a transaction-level advisory lock first (see lock_schema), so app
+# workers starting together create and upgrade the schema one at a time.
+
+SCHEMA_UPGRADE_LOCK_ID = 7310204
+
+SCHEMA_UPGRADES: List[str] = [
+    # One conversation per (clinic_id, customer_phone), required by the upsert in
+    # app/services/persistence.py. Duplicates left by the old get-or-create are merged
+    # into the oldest conversation before the constraint is added.
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_chat_history_clinic_phone') THEN
+            UPDATE message m SET chat_history_id = d.keep_id
+            FROM (
+                SELECT id, min(id) OVER (PARTITION BY clinic_id, customer_phone) AS keep_id
+                FROM chat_history
+                WHERE clinic_id IS NOT NULL AND customer_phone IS NOT NULL
+            ) d
+            WHERE m.chat_history_id = d.id AND d.id <> d.keep_id;
+
+            DELETE FROM chat_history c
+            USING chat_history k
+            WHERE c.clinic_id = k.clinic_id AND c.customer_phone = k.customer_phone AND c.id > k.id;
+
+            ALTER TABLE chat_history
+                ADD CONSTRAINT uq_chat_history_clinic_phone UNIQUE (clinic_id, customer_phone);
+        END IF;
+    END $$;
+    """,
+    # Rolling conversation summary and the bounded history window query.
+    """
+    ALTER TABLE chat_history
+        ADD COLUMN IF NOT EXISTS summary TEXT,
+        ADD COLUMN IF NOT EXISTS summarized_until TIMESTAMP WITHOUT TIME ZONE,
+        ADD COLUMN IF NOT EXISTS summarized_until_id INTEGER
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_message_chat_history_id_timestamp ON message (chat_history_id, timestamp)",
+    # Clinic-scoped keyset pagination of messages (app/services/chat_export.py). The
+    # column is backfilled from the conversations once, when it is added.
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = 'message' AND column_name = 'clinic_id'
+        ) THEN
+            ALTER TABLE message ADD COLUMN clinic_id INTEGER REFERENCES clinic (id);
+            UPDATE message m SET clinic_id = c.clinic_id FROM chat_history c WHERE m.chat_history_id = c.id;
+        END IF;
+    END $$;
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_message_clinic_id_timestamp_id ON message (clinic_id, timestamp, id)",
+    "DROP INDEX IF EXISTS ix_message_timestamp_id",
+    # Structured-data fast path answers are counted apart from semantic cache hits.
+    "ALTER TABLE clinic_stats_rollup ADD COLUMN IF NOT EXISTS templated_replies INTEGER NOT NULL DEFAULT 0",
+    # Inbound messages are routed to clinics by their WhatsApp number (app/services/clinic_routing.py).
+    "ALTER TABLE clinic ADD COLUMN IF NOT EXISTS whatsapp_number VARCHAR",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_clinic_whatsapp_number ON clinic (whatsapp_number)",
+]
+
+
+async def lock_schema(conn: AsyncConnection):
+    """
+    Serializes schema changes across processes until the caller's transaction ends.
+    """
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": SCHEMA_UPGRADE_LOCK_ID})
+
+
+async def upgrade_schema(conn: AsyncConnection):
+    """
+    Applies SCHEMA_UPGRADES within the caller's transaction (after lock_schema).
+    """
+    for statement in SCHEMA_UPGRADES:
+        await conn.execute(text(statement))
+    logger.info(f"Applied {len(SCHEMA_UPGRADES)} schema upgrade steps.")
@@ -0,0 +1,32 @@
+from sqlalchemy import BigInteger, Column, DateTime, Float, ForeignKey, Integer, String
+from app.models.base import Base
+
+class ClinicStatsRollup(Base):
+    """
+    Per-clinic conversation aggregates for one hourly or daily bucket,
+    incremented as turns are persisted (see app/services/analytics.py).
+    """
+    __tablename__ = "clinic_stats_rollup"
+    clinic_id = Column(Integer, ForeignKey("clinic.id", ondelete="CASCADE"), primary_key=True)
+    granularity = Column(String, primary_key=True)  # 'hour' or 'day'
+    bucket_start = Column(DateTime, primary_key=True)  # UTC
+
+    turns = Column(Integer, nullable=False, default=0)
+    messages = Column(Integer, nullable=False, default=0)  # user + assistant
+    unique_patients = Column(Integer, nullable=False, default=0)
+    reply_seconds_total = Column(Float, nullable=False, default=0.0)  # Sum of inbound -> reply delivered
+    prompt_tokens = Column(BigInteger, nullable=False, default=0)
+    completion_tokens = Column(BigInteger, nullable=False, default=0)
+    cached_replies = Column(Integer, nullable=False, default=0)  # Semantic cache hits
+    templated_replies = Column(Integer, nullable=False, default=0)  # Structured-data fast path answers
+    failed_replies = Column(Integer, nullable=False, default=0)
+
+class ClinicPatientActivity(Base):
+    """
+    Customers seen per clinic and bucket; makes `unique_patients` exact under incremental updates.
+    """
+    __tablename__ = "clinic_patient_activity"
+    clinic_id = Column(Integer, ForeignKey("clinic.id", ondelete="CASCADE"), primary_key=True)
+    granularity = Column(String, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    customer_phone = Column(String, primary_key=True)
@@ -1,23 +1,40 @@
 import datetime
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from app.models.base import Base
 
 class ChatHistory(Base):
     __tablename__ = "chat_history"
+    __table_args__ = (
+        # One conversation per customer and clinic; lets writers upsert instead of get-or-create
+        UniqueConstraint("clinic_id", "customer_phone", name="uq_chat_history_clinic_phone"),
+    )
     id = Column(Integer, primary_key=True)
     customer_phone = Column(String, index=True)
     clinic_id = Column(Integer, ForeignKey("clinic.id"))
+
+    # Rolling summary of turns older than the history window
+    summary = Column(Text, nullable=True)
+    summarized_until = Column(DateTime, nullable=True)  # (timestamp, id) of the last summarized message
+    summarized_until_id = Column(Integer, nullable=True)
     
     clinic = relationship("Clinic", back_populates="chat_histories")
     messages = relationship("Message", back_populates="chat_history", cascade="all, delete-orphan")
 
 class Message(Base):
     __tablename__ = "message"
+    __table_args__ = (
+        # Serves "last N messages of a conversation" without scanning the whole history
+        Index("ix_message_chat_history_id_timestamp", "chat_history_id", "timestamp"),
+        # Keyset pagination and date-range scans over one clinic's messages
+        Index("ix_message_clinic_id_timestamp_id", "clinic_id", "timestamp", "id"),
+    )
     id = Column(Integer, primary_key=True)
     content = Column(Text, nullable=False)
     role = Column(String, nullable=False) # 'user' or 'assistant'
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     chat_history_id = Column(Integer, ForeignKey("chat_history.id"))
+    # Denormalized from chat_history, so a clinic's messages can be scanned by index without the join
+    clinic_id = Column(Integer, ForeignKey("clinic.id"), nullable=True)
     
     chat_history = relationship("ChatHistory", back_populates="messages")
@@ -7,6 +7,7 @@ class Clinic(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String, index=True, nullable=False)
     owner_id = Column(Integer, ForeignKey("user.id"), unique=True)
+    whatsapp_number = Column(String, unique=True, index=True, nullable=True)  # Provider number, e.g. "+14155238886"
     
     # AI Customization
     ai_tone = Column(String, default="professional and friendly")
@@ -0,0 +1,29 @@
+import datetime
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, UniqueConstraint
+from app.models.base import Base
+
+class DocumentManifest(Base):
+    """
+    Content hashes of the chunks currently indexed for one uploaded document.
+    Lets a re-upload embed only new chunks and delete the vectors of removed ones.
+    """
+    __tablename__ = "document_manifest"
+    __table_args__ = (
+        UniqueConstraint("clinic_id", "filename", name="uq_document_manifest_clinic_filename"),
+    )
+    id = Column(Integer, primary_key=True)
+    clinic_id = Column(Integer, ForeignKey("clinic.id", ondelete="CASCADE"), nullable=False)
+    filename = Column(String, nullable=False)
+    chunk_hashes = Column(JSON, nullable=False, default=list)  # Sorted list of chunk hashes
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class DocumentChunk(Base):
+    """
+    Text of an indexed document chunk, keyed by its content hash.
+    The source of the per-clinic keyword index (see app/services/lexical_index.py).
+    """
+    __tablename__ = "document_chunk"
+    clinic_id = Column(Integer, ForeignKey("clinic.id", ondelete="CASCADE"), primary_key=True)
+    filename = Column(String, primary_key=True)
+    chunk_hash = Column(String(32), primary_key=True)
+    text = Column(Text, nullable=False)
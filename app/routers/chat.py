@@ -1,11 +1,17 @@
 # Bu dosya, WhatsApp ve sohbetle ilgili endpoint'leri yönetir.
 # WhatsApp'tan gelen mesajları alma, doküman yükleme ve sohbet akışı gibi işlemler buradadır.
 
-from fastapi import APIRouter, Depends, Request, Form, HTTPException, status
+from fastapi import APIRouter, Depends, Request, Form, HTTPException, File, UploadFile, status
 from loguru import logger  # Gelişmiş loglama için.
 from sse_starlette.sse import EventSourceResponse  # Server-Sent Events (SSE) için.
+from starlette.concurrency import run_in_threadpool  # Senkron çağrıları event loop dışında çalıştırmak için.
 
-from app.background.tasks import process_whatsapp_message, add_document_to_vectorstore  # Arka plan görevleri.
+from app.background.tasks import process_whatsapp_message, add_stored_document_to_vectorstore, flush_message_burst  # Arka plan görevleri.
+from app.background.sharding import enqueue_conversation_turn  # Konuşma bazlı sıralı kuyruklar için.
+from app.config import settings
+from app.services.coalescer import add_to_burst  # Art arda gelen mesajları birleştirmek için.
+from app.services.document_storage import DocumentTooLarge, save_document, save_text  # Yüklenen dokümanların depolanması için.
+from app.services.idempotency import claim_inbound_message, release_inbound_message  # Tekrarlanan webhook'ları elemek için.
 from app.schemas.chat import WhatsAppMessageIn, DocumentUpload  # Pydantic şemaları.
 from app.services.ai_engine import get_streaming_chat_response  # Yapay zeka servisleri.
 from app.models.user import User
@@ -13,32 +19,58 @@ from app.services.auth import current_active_user
 
 router = APIRouter()
 
+def _enqueue_inbound_message(message_data: dict):
+    """
+    Gelen mesajı işlenmek üzere sıraya alır (Redis/Celery'ye senkron çağrılar yapar).
+    """
+    if settings.BURST_QUIET_SECONDS > 0:
+        # Kullanıcı tek bir düşünceyi birkaç hızlı mesajla gönderebilir; mesajı tampona ekle.
+        # Birleştirme görevini patlamanın ilk mesajı (ya da görevi kaybolmuş bir patlamanın yeni mesajı) zamanlar.
+        burst_key = add_to_burst(message_data)
+        if burst_key:
+            flush_message_burst.apply_async(args=[burst_key], countdown=settings.BURST_QUIET_SECONDS)
+    else:
+        # Görevi konuşmanın kuyruğuna ekle (sharding açıksa aynı müşterinin mesajları sırayla işlenir).
+        enqueue_conversation_turn(process_whatsapp_message, message_data)
+
 @router.post("/whatsapp/webhook", status_code=status.HTTP_202_ACCEPTED)
 async def whatsapp_webhook(request: Request):
     """
     WhatsApp'tan (Twilio aracılığıyla) mesajları almak için webhook.
     İsteği doğrular, bir Pydantic modeline dönüştürür ve Celery ile arka planda işlenmek üzere sıraya alır.
+    Twilio'nun yeniden denemeleri MessageSid üzerinden elenir; her mesaj yalnızca bir kez kabul edilir.
     """
+    # Gelen isteğin form verilerini al. Twilio bu formatta gönderir.
+    form_data = await request.form()
+
+    # Aynı MessageSid daha önce kabul edildiyse (Twilio yeniden denemesi), hiçbir iş yapmadan hemen dön.
+    message_sid = form_data.get("MessageSid")
+    if message_sid and not await claim_inbound_message(message_sid):
+        logger.info(f"Tekrarlanan webhook yok sayıldı: {message_sid}")
+        return {"status": "mesaj zaten alındı"}
+
     try:
-        # Gelen isteğin form verilerini al. Twilio bu formatta gönderir.
-        form_data = await request.form()
         # Form verilerini Pydantic modelimizle doğrulamak için dönüştür.
         message_data = WhatsAppMessageIn(
             From=form_data.get("From"),  # Gönderenin numarası
             To=form_data.get("To"),      # Alıcının (kliniğin) numarası
-            Body=form_data.get("Body")   # Mesajın içeriği
+            Body=form_data.get("Body"),  # Mesajın içeriği
+            MessageSid=message_sid,      # Sağlayıcının mesaj kimliği
         )
         logger.info(f"Mesaj alındı: {message_data.From} -> {message_data.Body}")
         
         # Asıl işlemeyi (AI'ya sorma vb.) bir arka plan görevine devret.
-        # .delay() metodu, görevi Celery kuyruğuna ekler.
-        process_whatsapp_message.delay(message_data.model_dump())
+        # Sıraya alma senkron ağ çağrıları yapar; event loop'u bloklamamak için thread pool'da çalıştır.
+        await run_in_threadpool(_enqueue_inbound_message, message_data.model_dump())
         
         # Twilio'ya mesajın alındığını bildirmek için hemen yanıt ver.
         # Bu, webhook'un zaman aşımına uğramasını engeller.
         return {"status": "mesaj işlenmek üzere sıraya alındı"}
     except Exception as e:
         logger.error(f"Webhook işlenirken hata: {e}")
+        # Mesaj sıraya alınamadı; Twilio'nun yeniden denemesi kabul edilebilsin diye kaydı serbest bırak.
+        if message_sid:
+            await release_inbound_message(message_sid)
         raise HTTPException(status_code=400, detail="Geçersiz veya bozuk istek verisi")
 
 @router.post("/documents/upload", status_code=status.HTTP_202_ACCEPTED)
@@ -48,17 +80,48 @@ async def upload_document(
 ):
     """
     Klinik sahibinin bir doküman (örn. SSS) yüklemesini sağlar.
-    Doküman içeriği, parçalara ayırma, gömme (embedding) ve vektör veritabanına
-    kaydetme işlemleri için bir arka plan görevine gönderilir.
+    Doküman içeriği depolamaya yazılır; parçalara ayırma, gömme (embedding) ve vektör
+    veritabanına kaydetme işlemleri için arka plan görevine yalnızca dosyanın referansı gönderilir.
+    Büyük dosyalar için /documents/upload-file (multipart) tercih edilmelidir.
     """
     if not user.clinic:
         raise HTTPException(status_code=403, detail="Kullanıcının bir kliniği yok.")
     
     clinic_id = user.clinic.id
-    # Görevi arka plan kuyruğuna ekle.
-    add_document_to_vectorstore.delay(doc.content, doc.filename, clinic_id)
+    try:
+        storage_key = await run_in_threadpool(save_text, doc.content, clinic_id, doc.filename)
+    except DocumentTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    # Görevi arka plan kuyruğuna ekle (içerik değil, sadece depolama anahtarı gider).
+    task = add_stored_document_to_vectorstore.delay(storage_key, doc.filename, clinic_id)
     
-    return {"status": "Doküman yükleme başlatıldı. Arka planda işlenecektir."}
+    return {"status": "Doküman yükleme başlatıldı. Arka planda işlenecektir.", "task_id": task.id}
+
+@router.post("/documents/upload-file", status_code=status.HTTP_202_ACCEPTED)
+async def upload_document_file(
+    file: UploadFile = File(...),
+    user: User = Depends(current_active_user)
+):
+    """
+    Dokümanı multipart dosya olarak yükler (UTF-8 metin, örn. .txt veya .md).
+    Dosya depolamaya parça parça kopyalanır, böylece bellek kullanımı dosya boyutundan bağımsızdır;
+    arka plan görevi dosyayı yine parça parça okuyup işler.
+    """
+    if not user.clinic:
+        raise HTTPException(status_code=403, detail="Kullanıcının bir kliniği yok.")
+
+    clinic_id = user.clinic.id
+    filename = file.filename or "document.txt"
+    try:
+        # Dosya kopyalama senkron disk işlemidir; event loop'u bloklamamak için thread pool'da çalıştır.
+        storage_key = await run_in_threadpool(save_document, file.file, clinic_id, filename)
+    except DocumentTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    finally:
+        await file.close()
+
+    task = add_stored_document_to_vectorstore.delay(storage_key, filename, clinic_id)
+    return {"status": "Doküman yükleme başlatıldı. Arka planda işlenecektir.", "task_id": task.id}
 
 @router.get("/stream/{customer_phone}")
 async def stream_chat(customer_phone: str, user_message: str, user: User = Depends(current_active_user)):
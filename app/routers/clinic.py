@@ -2,6 +2,8 @@
 # Klinikleri oluşturma, getirme, güncelleme ve servislere ekleme işlemleri buradadır.
 
 from fastapi import APIRouter, Depends, HTTPException, status  # Gerekli FastAPI bileşenleri.
+from fastapi.concurrency import run_in_threadpool  # Senkron Redis çağrılarını event loop dışında çalıştırmak için.
+from sqlalchemy.exc import IntegrityError  # Benzersizlik ihlallerini yakalamak için.
 from sqlalchemy.ext.asyncio import AsyncSession  # Asenkron veritabanı oturumları için.
 from sqlalchemy.future import select  # Modern SQLAlchemy sorguları için.
 from sqlalchemy.orm import selectinload  # İlişkili verileri (örn. servisler) verimli bir şekilde yüklemek için.
@@ -12,10 +14,27 @@ from app.models.clinic import Clinic, Service  # Veritabanı modelleri.
 from app.models.user import User  # User modeli.
 from app.schemas.clinic import ClinicCreate, Clinic as ClinicSchema, ServiceCreate, Service as ServiceSchema  # Pydantic şemaları.
 from app.services.auth import current_active_user  # Aktif ve kimliği doğrulanmış kullanıcıyı getiren dependency.
+from app.services.clinic_versions import bump_clinic_version  # Klinik önbelleklerini geçersiz kılmak için.
+from app.services.clinic_routing import invalidate_clinic_routing  # Numara -> klinik önbelleğini temizlemek için.
 
 # Yeni bir router nesnesi oluşturuyoruz.
 router = APIRouter()
 
+async def _commit_clinic(session: AsyncSession):
+    """
+    Klinik değişikliklerini kaydeder; benzersizlik ihlalini (örn. başka bir kliniğin
+    WhatsApp numarası) 500 yerine 409 Conflict olarak döndürür.
+    """
+    try:
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        if "whatsapp_number" in str(e.orig):
+            detail = "Bu WhatsApp numarası başka bir klinik tarafından kullanılıyor."
+        else:
+            detail = "Klinik bilgileri mevcut bir kayıtla çakışıyor."
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=detail)
+
 @router.post("/", response_model=ClinicSchema, status_code=status.HTTP_201_CREATED)
 async def create_clinic(
     clinic_data: ClinicCreate,  # İstek gövdesinden gelen ve ClinicCreate şemasıyla doğrulanan klinik verileri.
@@ -33,8 +52,10 @@ async def create_clinic(
     # Yeni bir Clinic nesnesi oluştur ve verileri ata. owner_id'yi mevcut kullanıcıdan al.
     db_clinic = Clinic(**clinic_data.model_dump(), owner_id=user.id)
     session.add(db_clinic)  # Yeni kliniği veritabanı oturumuna ekle.
-    await session.commit()  # Değişiklikleri veritabanına kaydet.
+    await _commit_clinic(session)  # Değişiklikleri veritabanına kaydet.
     await session.refresh(db_clinic)  # Veritabanından güncel verileri (örn. ID) çek.
+    if db_clinic.whatsapp_number:
+        await run_in_threadpool(invalidate_clinic_routing)  # Yeni numara, worker'ların yönlendirme önbelleğine yansısın.
     return db_clinic  # Oluşturulan kliniği döndür.
 
 @router.get("/", response_model=ClinicSchema)
@@ -65,14 +86,18 @@ async def update_clinic(
     if not clinic:
         raise HTTPException(status_code=404, detail="Klinik bulunamadı.")
 
+    previous_number = clinic.whatsapp_number
     # Gelen verilerdeki her bir anahtar-değer çifti için...
     for key, value in clinic_data.model_dump(exclude_unset=True).items():
         # ...klinik nesnesinin ilgili özelliğini güncelle.
         setattr(clinic, key, value)
     
     session.add(clinic)  # Güncellenmiş nesneyi oturuma ekle.
-    await session.commit()  # Değişiklikleri kaydet.
+    await _commit_clinic(session)  # Değişiklikleri kaydet.
     await session.refresh(clinic)  # Güncel veriyi çek.
+    await run_in_threadpool(bump_clinic_version, clinic.id)  # Ton/dil değişti; eski önbellek kayıtları artık geçersiz.
+    if clinic.whatsapp_number != previous_number:
+        await run_in_threadpool(invalidate_clinic_routing)  # Numara değişti; yönlendirme önbelleğini temizle.
     return clinic
 
 @router.post("/services", response_model=ServiceSchema, status_code=status.HTTP_201_CREATED)
@@ -92,6 +117,7 @@ async def add_service_to_clinic(
     session.add(db_service)
     await session.commit()
     await session.refresh(db_service)
+    await run_in_threadpool(bump_clinic_version, user.clinic.id)  # Servis listesi değişti; önbellekleri geçersiz kıl.
     return db_service
 
 @router.get("/services", response_model=List[ServiceSchema])
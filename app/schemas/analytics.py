@@ -0,0 +1,24 @@
+import datetime
+from pydantic import BaseModel, ConfigDict, computed_field
+
+class ClinicStatsBucket(BaseModel):
+    """
+    Aggregates of one hourly or daily bucket. `unique_patients` is exact per bucket
+    and therefore can't be summed across buckets.
+    """
+    bucket_start: datetime.datetime
+    turns: int
+    messages: int
+    unique_patients: int
+    reply_seconds_total: float
+    prompt_tokens: int
+    completion_tokens: int
+    cached_replies: int
+    templated_replies: int
+    failed_replies: int
+    model_config = ConfigDict(from_attributes=True)
+
+    @computed_field
+    @property
+    def avg_reply_seconds(self) -> float:
+        return self.reply_seconds_total / self.turns if self.turns else 0.0
@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from typing import Optional
+import datetime
+from pydantic import BaseModel, ConfigDict
+from typing import List, Optional
 
 class WhatsAppMessageIn(BaseModel):
     """
@@ -9,7 +10,28 @@ class WhatsAppMessageIn(BaseModel):
     From: str  # e.g., "whatsapp:+14155238886"
     To: str    # e.g., "whatsapp:+15005550006"
     Body: str  # The message text
+    MessageSid: Optional[str] = None  # Provider message ID, used to drop webhook retries
 
 class DocumentUpload(BaseModel):
     content: str
-    filename: str
\ No newline at end of file
+    filename: str
+
+class ChatMessageOut(BaseModel):
+    """
+    A single message of a conversation, as listed and exported by the admin endpoints.
+    """
+    id: int
+    chat_history_id: int
+    customer_phone: str
+    role: str
+    content: str
+    timestamp: Optional[datetime.datetime] = None  # Only missing on legacy rows, which pages skip
+    model_config = ConfigDict(from_attributes=True)
+
+class ChatMessagePage(BaseModel):
+    """
+    One page of messages, newest first. Pass `next_cursor` back as `cursor` to get the next page;
+    it is None on the last page.
+    """
+    items: List[ChatMessageOut]
+    next_cursor: Optional[str] = None
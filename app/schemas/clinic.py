@@ -1,6 +1,8 @@
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, field_validator
 from typing import List, Optional
 
+from app.utils.phone import normalize_whatsapp_number
+
 class ServiceBase(BaseModel):
     name: str
     description: Optional[str] = None
@@ -17,6 +19,12 @@ class ClinicBase(BaseModel):
     name: str
     ai_tone: Optional[str] = "professional and friendly"
     ai_language: Optional[str] = "English"
+    whatsapp_number: Optional[str] = None
+
+    @field_validator("whatsapp_number")
+    @classmethod
+    def normalize_number(cls, value: Optional[str]) -> Optional[str]:
+        return normalize_whatsapp_number(value) or None if value else None
 
 class ClinicCreate(ClinicBase):
     pass
@@ -1,89 +1,365 @@
+import asyncio
+import datetime
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
 import openai
 from loguru import logger
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
 
 from app.config import settings
-from app.models.clinic import Clinic
-from app.models.chat import ChatHistory, Message
-from app.utils.prompt_builder import build_prompt
-from app.services.vectorstore import query_vectorstore
+from app.services.vectorstore import embed_query, query_vectorstore_chunks
+from app.services.answer_cache import answer_cache
+from app.services.history import load_history_window
+from app.services.clinic_profile import get_clinic_profile
+from app.services.intent_matcher import IntentMatch, match_structured_intent
+from app.services.lexical_index import LexicalIndex, fuse_rankings, get_lexical_index
+from app.services.prompt_assembler import assemble_prompt
+from app.services.persistence import persist_turn
+from app.services.analytics import TurnStats
+from app.utils.concurrency import run_blocking
+from app.utils.tokens import count_tokens
+from app.services.metrics import (
+    CACHE_LOOKUPS,
+    INTENT_FASTPATH,
+    LLM_SECONDS_SAVED,
+    LLM_TOKENS,
+    PROMPT_SECTION_TOKENS,
+    RETRIEVAL_PATH,
+    STREAM_TIME_TO_FIRST_TOKEN,
+    STREAM_TOKENS_PER_SECOND,
+    clinic_label,
+    track_stage,
+)
 
 # Configure OpenAI client
 openai.api_key = settings.OPENAI_API_KEY
 
-async def get_ai_response(session: AsyncSession, clinic_id: int, customer_phone: str, user_message: str) -> str:
+CLINIC_UNAVAILABLE_MESSAGE = "I'm sorry, I can't access the clinic information right now."
+GENERATION_FAILED_MESSAGE = "I'm sorry, I'm having trouble connecting to my brain right now. Please try again later."
+
+def _is_standalone_turn(last_message_at) -> bool:
     """
-    Generates a response from the AI, augmented with context from the vector store (RAG).
+    A turn is treated as independent of the conversation history when there is no
+    history, or the conversation has been idle long enough to start a new topic.
+    """
+    if last_message_at is None:
+        return True
+    idle = datetime.datetime.utcnow() - last_message_at
+    return idle.total_seconds() >= settings.SEMANTIC_CACHE_IDLE_SECONDS
+
+@dataclass
+class TurnContext:
+    """
+    Everything needed to generate the reply for one turn. Serializable, so the
+    pipeline can checkpoint it and resume generation without redoing retrieval.
+    """
+    clinic_id: int
+    user_message: str
+    messages: List[dict] = field(default_factory=list)
+    # Set when the turn can be answered without calling the LLM
+    cached_answer: Optional[str] = None
+    templated: bool = False  # cached_answer comes from the structured-data fast path, not the semantic cache
+    # Semantic cache scope for storing the generated answer (None = don't cache)
+    cache_version: Optional[int] = None
+    prompt_usage: Dict[str, int] = field(default_factory=dict)
+    query_embedding: Optional[List[float]] = field(default=None, repr=False)
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data.pop("query_embedding")  # Cheap to recompute through the embedding cache
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TurnContext":
+        return cls(**data)
+
+
+@dataclass
+class GeneratedReply:
+    text: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    seconds: float = 0.0
+    from_cache: bool = False
+    templated: bool = False
+    failed: bool = False
+
+
+@dataclass
+class _RetrievalPlan:
+    """
+    The query-side half of retrieval, prepared while the history loads. The vector
+    index is only queried afterwards (see _finish_retrieval), once the semantic cache
+    has been checked with the query embedding.
+    """
+    query_embedding: Optional[List[float]] = None
+    lexical_chunks: List[str] = field(default_factory=list)
+    hybrid: bool = False
+    done: bool = False  # lexical_chunks are the final result; don't query the vector index
+
+
+async def _plan_retrieval(clinic_id: int, user_message: str, lexical_index: Optional[LexicalIndex] = None, top_k: int = 3) -> _RetrievalPlan:
+    """
+    Runs the keyword search and embeds the query (through the embedding cache). An
+    unambiguous keyword match is final and skips the embedding call altogether.
+    """
+    plan = _RetrievalPlan(hybrid=lexical_index is not None)
+    if lexical_index is not None:
+        with track_stage("lexical_search", clinic_id):
+            lexical = lexical_index.search(user_message, top_k)
+        plan.lexical_chunks = [match.text for match in lexical.matches]
+        if settings.LEXICAL_FASTPATH_ENABLED and lexical.confident:
+            RETRIEVAL_PATH.labels("lexical_fast_path").inc()
+            logger.info(f"Keyword fast path for clinic {clinic_id}: '{user_message[:50]}' -> '{plan.lexical_chunks[0][:80]}'")
+            plan.done = True
+            return plan
+
+    try:
+        with track_stage("embedding", clinic_id):
+            plan.query_embedding = await run_blocking(embed_query, user_message)
+    except Exception as e:
+        logger.error(f"Failed to embed query for clinic {clinic_id}: {e}")
+        plan.done = True
+    return plan
+
+
+async def _finish_retrieval(clinic_id: int, user_message: str, plan: _RetrievalPlan, top_k: int = 3) -> List[str]:
+    """
+    Queries the vector index with the planned embedding and fuses the results with the
+    keyword matches. Returns the RAG chunks, most relevant first.
+    """
+    if plan.done:
+        return plan.lexical_chunks
+    rag_chunks = await query_vectorstore_chunks(clinic_id, user_message, top_k, query_embedding=plan.query_embedding)
+    if not plan.hybrid:
+        RETRIEVAL_PATH.labels("vector").inc()
+        return rag_chunks
+    RETRIEVAL_PATH.labels("hybrid").inc()
+    return fuse_rankings([rag_chunks, plan.lexical_chunks], top_k)
+
+
+async def build_turn_context(session: AsyncSession, clinic_id: int, customer_phone: str, user_message: str) -> Optional[TurnContext]:
+    """
+    Retrieves clinic info, history and RAG context and assembles the prompt for a turn.
+    Returns None if the clinic doesn't exist.
     """
-    # 1. Retrieve Clinic Info
-    stmt = select(Clinic).where(Clinic.id == clinic_id).options(selectinload(Clinic.services))
-    result = await session.execute(stmt)
-    clinic = result.scalars().first()
+    # 1. Retrieve Clinic Info (cached per clinic version, including the static prompt prefix)
+    with track_stage("clinic_profile", clinic_id):
+        clinic = await get_clinic_profile(session, clinic_id)
     if not clinic:
         logger.error(f"Clinic with ID {clinic_id} not found.")
-        return "I'm sorry, I can't access the clinic information right now."
-
-    # 2. Retrieve Chat History
-    history_stmt = select(ChatHistory).where(
-        ChatHistory.clinic_id == clinic_id,
-        ChatHistory.customer_phone == customer_phone
-    ).options(selectinload(ChatHistory.messages))
-    history_result = await session.execute(history_stmt)
-    chat_history = history_result.scalars().first()
-    
-    messages = []
-    if chat_history:
-        # Get last 10 messages to keep context window small and relevant
-        sorted_messages = sorted(chat_history.messages, key=lambda m: m.timestamp)
-        for msg in sorted_messages[-10:]:
-            messages.append({"role": msg.role, "content": msg.content})
-
-    # 3. Retrieve RAG Context from Vector Store
-    rag_context = await query_vectorstore(clinic_id, user_message)
-
-    # 4. Build the System Prompt
-    system_prompt = build_prompt(clinic, rag_context)
-    messages.insert(0, {"role": "system", "content": system_prompt})
-    messages.append({"role": "user", "content": user_message})
+        return None
 
-    # 5. Call OpenAI API
+    # 1b. Simple service/price lookups are answered from the clinic data, without RAG or the LLM.
+    # Only for stand-alone turns: mid-conversation, "botox" may answer the assistant's question.
+    history = None
+    if settings.INTENT_FASTPATH_ENABLED:
+        with track_stage("intent_match", clinic_id):
+            match = match_structured_intent(clinic, user_message)
+        if match.answer is not None:
+            with track_stage("history", clinic_id):
+                history = await load_history_window(session, clinic_id, customer_phone, settings.HISTORY_WINDOW_MESSAGES)
+            if not _is_standalone_turn(history.last_message_at):
+                match = IntentMatch(match.intent, "mid_conversation")
+        INTENT_FASTPATH.labels(match.intent, match.result).inc()
+        if match.answer is not None:
+            logger.info(f"Structured {match.intent} answer for clinic {clinic_id}: '{user_message[:50]}'")
+            return TurnContext(clinic_id=clinic_id, user_message=user_message, cached_answer=match.answer, templated=True)
+
+    # The keyword index is cached per clinic version too, so this only queries on a change.
+    lexical_index = None
+    if settings.HYBRID_RETRIEVAL_ENABLED:
+        with track_stage("lexical_index", clinic_id):
+            lexical_index = await get_lexical_index(session, clinic)
+
+    # Embedding the query doesn't need the database session, so it runs concurrently
+    # with the history lookup below.
+    retrieval = asyncio.create_task(_plan_retrieval(clinic_id, user_message, lexical_index))
     try:
-        logger.info(f"Calling OpenAI for clinic {clinic_id} with model {settings.CHAT_MODEL}...")
-        response = await openai.ChatCompletion.acreate(
-            model=settings.CHAT_MODEL,
-            messages=messages,
-            temperature=0.7,
+        # 2. Retrieve Chat History (only the last N messages, plus the rolling summary)
+        if history is None:
+            with track_stage("history", clinic_id):
+                history = await load_history_window(session, clinic_id, customer_phone, settings.HISTORY_WINDOW_MESSAGES)
+    except BaseException:
+        retrieval.cancel()
+        raise
+
+    # 3. Wait for the query embedding (or the keyword fast path result)
+    with track_stage("retrieval_wait", clinic_id):
+        plan = await retrieval
+    query_embedding = plan.query_embedding
+    context = TurnContext(clinic_id=clinic_id, user_message=user_message, query_embedding=query_embedding)
+
+    # 3b. Semantic answer cache for stand-alone questions
+    if settings.SEMANTIC_CACHE_ENABLED and query_embedding is not None and _is_standalone_turn(history.last_message_at):
+        context.cache_version = clinic.version
+        # The lookup records its hit/miss counters in Redis, so keep it off the event loop.
+        cached = await run_blocking(answer_cache.lookup, clinic_id, clinic.version, query_embedding)
+        CACHE_LOOKUPS.labels("answer", "hit" if cached else "miss").inc()
+        if cached:
+            LLM_SECONDS_SAVED.labels(clinic_label(clinic_id)).inc(cached.generation_seconds)
+            logger.info(f"Semantic cache hit for clinic {clinic_id}: '{user_message[:50]}' ~ '{cached.question[:50]}'")
+            context.cached_answer = cached.answer
+            return context
+
+    # 3c. RAG context from the vector index, queried only when the cache can't answer
+    rag_chunks = await _finish_retrieval(clinic_id, user_message, plan)
+
+    # 4. Assemble the prompt within the token budget
+    with track_stage("prompt_assembly", clinic_id):
+        prompt = assemble_prompt(
+            clinic,
+            rag_chunks=rag_chunks,
+            history=[{"role": msg.role, "content": msg.content} for msg in history.messages],
+            user_message=user_message,
+            summary=history.summary,
         )
+    context.messages = prompt.messages
+    context.prompt_usage = prompt.usage
+    for section, tokens in prompt.usage.items():
+        PROMPT_SECTION_TOKENS.labels(section, clinic_label(clinic_id)).observe(tokens)
+    logger.info(f"Prompt token usage for clinic {clinic_id}: {prompt.usage}")
+    return context
+
+
+async def _remember_answer(context: TurnContext, answer: str, generation_seconds: float):
+    """
+    Stores a freshly generated stand-alone answer in the semantic cache.
+    Best effort: the answer has already been generated (and paid for), so a failure
+    here (re-embedding after a checkpoint restore, Redis) is only logged.
+    """
+    if context.cache_version is None:
+        return
+    try:
+        query_embedding = context.query_embedding or await run_blocking(embed_query, context.user_message)
+        answer_cache.store(context.clinic_id, context.cache_version, query_embedding, context.user_message, answer, generation_seconds)
+    except Exception as e:
+        logger.warning(f"Could not store the answer for clinic {context.clinic_id} in the semantic cache: {e}")
+
+
+async def generate_reply(context: TurnContext) -> GeneratedReply:
+    """
+    Calls the LLM for a prepared turn (or returns the cached answer).
+    """
+    if context.cached_answer is not None:
+        return GeneratedReply(text=context.cached_answer, from_cache=not context.templated, templated=context.templated)
+
+    # 5. Call OpenAI API
+    try:
+        logger.info(f"Calling OpenAI for clinic {context.clinic_id} with model {settings.CHAT_MODEL}...")
+        started = time.perf_counter()
+        with track_stage("llm", context.clinic_id):
+            response = await openai.ChatCompletion.acreate(
+                model=settings.CHAT_MODEL,
+                messages=context.messages,
+                temperature=0.7,
+            )
+        elapsed = time.perf_counter() - started
         ai_message = response.choices[0].message.content.strip()
-        logger.info(f"OpenAI response for {customer_phone}: {ai_message[:100]}...")
-        return ai_message
+        logger.info(f"OpenAI response for clinic {context.clinic_id}: {ai_message[:100]}...")
+        usage = response.get("usage") or {}
+        LLM_TOKENS.labels("prompt", clinic_label(context.clinic_id)).inc(usage.get("prompt_tokens", 0))
+        LLM_TOKENS.labels("completion", clinic_label(context.clinic_id)).inc(usage.get("completion_tokens", 0))
+        reply = GeneratedReply(
+            text=ai_message,
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+            seconds=elapsed,
+        )
     except Exception as e:
         logger.error(f"OpenAI API call failed: {e}")
-        return "I'm sorry, I'm having trouble connecting to my brain right now. Please try again later."
+        return GeneratedReply(text=GENERATION_FAILED_MESSAGE, failed=True)
+
+    # Outside the try above: a cache failure must not turn a successful completion into a failed reply.
+    await _remember_answer(context, ai_message, elapsed)
+    return reply
+
+
+async def get_ai_response(session: AsyncSession, clinic_id: int, customer_phone: str, user_message: str) -> str:
+    """
+    Generates a response from the AI, augmented with context from the vector store (RAG).
+    """
+    context = await build_turn_context(session, clinic_id, customer_phone, user_message)
+    if context is None:
+        return CLINIC_UNAVAILABLE_MESSAGE
+    return (await generate_reply(context)).text
 
 async def get_streaming_chat_response(clinic_id: int, customer_phone: str, user_message: str):
     """
     Yields chunks of an AI response for streaming via SSE.
+    Uses the same context pipeline as get_ai_response (clinic prompt, history, RAG,
+    semantic cache) and persists the turn once the stream has completed.
+    Time-to-first-token and tokens/sec are recorded for every stream.
     """
-    # This is a simplified version. A real implementation would need to manage history
-    # and context similarly to the non-streaming version.
-    system_prompt = "You are a helpful assistant." # Replace with a real prompt builder call
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_message}
-    ]
-    try:
-        response_stream = await openai.ChatCompletion.acreate(
-            model=settings.CHAT_MODEL,
-            messages=messages,
-            stream=True
+    from app.database import async_session_maker
+
+    started = time.perf_counter()
+    received_at = datetime.datetime.utcnow()
+    async with async_session_maker() as session:
+        context = await build_turn_context(session, clinic_id, customer_phone, user_message)
+    if context is None:
+        yield CLINIC_UNAVAILABLE_MESSAGE
+        return
+
+    if context.cached_answer is not None:
+        yield context.cached_answer
+        reply = context.cached_answer
+        completion_tokens = 0
+        source = "structured-data fast path" if context.templated else "semantic cache"
+        logger.info(f"Stream for clinic {clinic_id} served from {source} in {time.perf_counter() - started:.3f}s")
+    else:
+        parts = []
+        first_token_at = None
+        try:
+            generation_started = time.perf_counter()
+            response_stream = await openai.ChatCompletion.acreate(
+                model=settings.CHAT_MODEL,
+                messages=context.messages,
+                temperature=0.7,
+                stream=True
+            )
+            async for chunk in response_stream:
+                content = chunk.choices[0].delta.get("content", "")
+                if content:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    parts.append(content)
+                    yield content
+        except Exception as e:
+            logger.error(f"OpenAI streaming call failed: {e}")
+            yield "Error: Could not get response."
+            return
+
+        finished_at = time.perf_counter()
+        reply = "".join(parts).strip()
+        completion_tokens = count_tokens(reply)
+        ttft = (first_token_at or finished_at) - started
+        generation_seconds = finished_at - (first_token_at or finished_at)
+        tokens_per_second = completion_tokens / generation_seconds if generation_seconds > 0 else 0.0
+        STREAM_TIME_TO_FIRST_TOKEN.labels(clinic_label(clinic_id)).observe(ttft)
+        STREAM_TOKENS_PER_SECOND.labels(clinic_label(clinic_id)).observe(tokens_per_second)
+        LLM_TOKENS.labels("completion", clinic_label(clinic_id)).inc(completion_tokens)
+        logger.info(
+            f"Stream for clinic {clinic_id}: time to first token {ttft:.3f}s, "
+            f"{completion_tokens} tokens at {tokens_per_second:.1f} tokens/s"
         )
-        async for chunk in response_stream:
-            content = chunk.choices[0].delta.get("content", "")
-            if content:
-                yield content
+        await _remember_answer(context, reply, finished_at - generation_started)
+
+    # Persist the completed turn
+    stats = TurnStats(
+        clinic_id=clinic_id,
+        customer_phone=customer_phone,
+        received_at=received_at,
+        reply_seconds=time.perf_counter() - started,
+        prompt_tokens=context.prompt_usage.get("total", 0) if context.cached_answer is None else 0,
+        completion_tokens=completion_tokens,
+        from_cache=context.cached_answer is not None and not context.templated,
+        templated=context.templated,
+    )
+    try:
+        async with async_session_maker() as session:
+            await persist_turn(session, clinic_id, customer_phone, user_message, reply, received_at, stats)
     except Exception as e:
-        logger.error(f"OpenAI streaming call failed: {e}")
-        yield "Error: Could not get response."
+        logger.error(f"Failed to persist streamed turn for {customer_phone}: {e}")
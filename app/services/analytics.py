@@ -0,0 +1,155 @@
+import datetime
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models.analytics import ClinicPatientActivity, ClinicStatsRollup
+
+# Conversation analytics rollups.
+# Every persisted turn increments the hourly and daily bucket rows of its clinic, so
+# dashboards read O(buckets) rows instead of scanning the message table. Workers pass
+# turns through the message write buffer, which applies them in the same transaction
+# as the buffered messages: deltas are summed per bucket in memory and written with one
+# multi-row upsert per flush, which keeps contention on a clinic's hot bucket rows low.
+# Unique patients are exact: a (clinic, bucket, phone) row is inserted with ON CONFLICT
+# DO NOTHING and only the rows that were actually inserted increment the counter.
+
+GRANULARITIES = ("hour", "day")
+_ADDITIVE_COLUMNS = (
+    "turns",
+    "messages",
+    "unique_patients",
+    "reply_seconds_total",
+    "prompt_tokens",
+    "completion_tokens",
+    "cached_replies",
+    "templated_replies",
+    "failed_replies",
+)
+
+BucketKey = Tuple[int, str, datetime.datetime]  # (clinic_id, granularity, bucket_start)
+
+
+@dataclass
+class TurnStats:
+    """
+    What a completed turn contributes to the rollups.
+    """
+    clinic_id: int
+    customer_phone: str
+    received_at: datetime.datetime
+    reply_seconds: float  # Inbound message received -> reply delivered
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    from_cache: bool = False  # Answered from the semantic cache
+    templated: bool = False  # Answered by the structured-data fast path
+    failed: bool = False
+
+
+def bucket_start(at: datetime.datetime, granularity: str) -> datetime.datetime:
+    if granularity == "hour":
+        return at.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return at.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def _aggregate(turns: List[TurnStats]) -> Tuple[List[dict], Dict[BucketKey, Counter]]:
+    activity = set()
+    deltas: Dict[BucketKey, Counter] = {}
+    for turn in turns:
+        for granularity in GRANULARITIES:
+            key = (turn.clinic_id, granularity, bucket_start(turn.received_at, granularity))
+            activity.add(key + (turn.customer_phone,))
+            delta = deltas.setdefault(key, Counter())
+            delta["turns"] += 1
+            delta["messages"] += 2
+            delta["reply_seconds_total"] += turn.reply_seconds
+            delta["prompt_tokens"] += turn.prompt_tokens
+            delta["completion_tokens"] += turn.completion_tokens
+            delta["cached_replies"] += int(turn.from_cache)
+            delta["templated_replies"] += int(turn.templated)
+            delta["failed_replies"] += int(turn.failed)
+    # Rows are written in key order so concurrent flushes lock them in the same order.
+    activity_rows = [
+        {"clinic_id": c, "granularity": g, "bucket_start": b, "customer_phone": p}
+        for c, g, b, p in sorted(activity)
+    ]
+    return activity_rows, deltas
+
+
+def _activity_stmt(rows: List[dict]):
+    return (
+        pg_insert(ClinicPatientActivity)
+        .values(rows)
+        .on_conflict_do_nothing()
+        .returning(ClinicPatientActivity.clinic_id, ClinicPatientActivity.granularity, ClinicPatientActivity.bucket_start)
+    )
+
+
+def _rollup_stmt(deltas: Dict[BucketKey, Counter], new_patients: Counter):
+    rows = [
+        {
+            "clinic_id": key[0],
+            "granularity": key[1],
+            "bucket_start": key[2],
+            **{column: delta[column] for column in _ADDITIVE_COLUMNS if column != "unique_patients"},
+            "unique_patients": new_patients[key],
+        }
+        for key, delta in sorted(deltas.items())
+    ]
+    stmt = pg_insert(ClinicStatsRollup).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[ClinicStatsRollup.clinic_id, ClinicStatsRollup.granularity, ClinicStatsRollup.bucket_start],
+        set_={column: getattr(ClinicStatsRollup, column) + getattr(stmt.excluded, column) for column in _ADDITIVE_COLUMNS},
+    )
+
+
+def write_rollups(db: Session, turns: List[TurnStats]):
+    """
+    Adds `turns` to the rollups within the caller's transaction (the caller commits).
+    """
+    if not turns:
+        return
+    activity_rows, deltas = _aggregate(turns)
+    new_patients = Counter(tuple(row) for row in db.execute(_activity_stmt(activity_rows)).all())
+    db.execute(_rollup_stmt(deltas, new_patients))
+
+
+async def write_rollups_async(session: AsyncSession, turns: List[TurnStats]):
+    """
+    Async variant of `write_rollups`, used by the API process.
+    """
+    if not turns:
+        return
+    activity_rows, deltas = _aggregate(turns)
+    result = await session.execute(_activity_stmt(activity_rows))
+    new_patients = Counter(tuple(row) for row in result.all())
+    await session.execute(_rollup_stmt(deltas, new_patients))
+
+
+async def get_clinic_rollups(
+    session: AsyncSession,
+    clinic_id: int,
+    granularity: str,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+) -> List[ClinicStatsRollup]:
+    """
+    Rollup buckets of a clinic in [since, until), oldest first.
+    """
+    stmt = select(ClinicStatsRollup).where(
+        ClinicStatsRollup.clinic_id == clinic_id,
+        ClinicStatsRollup.granularity == granularity,
+    )
+    if since is not None:
+        stmt = stmt.where(ClinicStatsRollup.bucket_start >= bucket_start(since, granularity))
+    if until is not None:
+        stmt = stmt.where(ClinicStatsRollup.bucket_start < until)
+    result = await session.execute(stmt.order_by(ClinicStatsRollup.bucket_start))
+    return list(result.scalars().all())
@@ -0,0 +1,124 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+
+from app.config import settings
+from app.services.redis_client import get_redis
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    created_at: float
+    generation_seconds: float
+
+
+class _ClinicEntries:
+    def __init__(self, version: int, dimension: int):
+        self.version = version
+        self.answers: List[CachedAnswer] = []
+        self.matrix = np.empty((0, dimension), dtype=np.float32)
+
+
+class SemanticAnswerCache:
+    """
+    Per-clinic cache of recent stand-alone answers, matched by embedding similarity.
+
+    Entries are scoped to the clinic's configuration version, so any change to the
+    clinic's services, tone/language or documents drops them. Hit/miss counters and the
+    LLM time saved are kept per clinic in Redis so they aggregate across workers.
+    """
+
+    def __init__(self, threshold: float, ttl_seconds: int, max_entries: int, dimension: int):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.dimension = dimension
+        self._clinics: Dict[int, _ClinicEntries] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def _entries(self, clinic_id: int, version: int) -> _ClinicEntries:
+        entries = self._clinics.get(clinic_id)
+        if entries is None or entries.version != version:
+            entries = self._clinics[clinic_id] = _ClinicEntries(version, self.dimension)
+        return entries
+
+    def _expire(self, entries: _ClinicEntries):
+        cutoff = time.time() - self.ttl_seconds
+        keep = [i for i, a in enumerate(entries.answers) if a.created_at >= cutoff]
+        if len(keep) != len(entries.answers):
+            entries.answers = [entries.answers[i] for i in keep]
+            entries.matrix = entries.matrix[keep]
+
+    def lookup(self, clinic_id: int, version: int, embedding: Sequence[float]) -> Optional[CachedAnswer]:
+        with self._lock:
+            entries = self._entries(clinic_id, version)
+            self._expire(entries)
+            if not entries.answers:
+                match = None
+            else:
+                scores = entries.matrix @ self._normalize(embedding)
+                best = int(np.argmax(scores))
+                match = entries.answers[best] if scores[best] >= self.threshold else None
+
+        if match is None:
+            self._record(clinic_id, hit=False)
+        else:
+            self._record(clinic_id, hit=True, seconds_saved=match.generation_seconds)
+        return match
+
+    def store(self, clinic_id: int, version: int, embedding: Sequence[float], question: str, answer: str, generation_seconds: float):
+        with self._lock:
+            entries = self._entries(clinic_id, version)
+            entries.answers.append(CachedAnswer(question, answer, time.time(), generation_seconds))
+            entries.matrix = np.vstack([entries.matrix, self._normalize(embedding)[None, :]])
+            if len(entries.answers) > self.max_entries:
+                entries.answers = entries.answers[-self.max_entries:]
+                entries.matrix = entries.matrix[-self.max_entries:]
+
+    def _record(self, clinic_id: int, hit: bool, seconds_saved: float = 0.0):
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            key = f"answer_cache:stats:{clinic_id}"
+            pipe.hincrby(key, "hits" if hit else "misses", 1)
+            if hit:
+                pipe.hincrbyfloat(key, "seconds_saved", seconds_saved)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not record answer cache stats for clinic {clinic_id}: {e}")
+
+
+def get_answer_cache_stats(clinic_id: int) -> dict:
+    """
+    Returns the aggregated semantic cache metrics for a clinic.
+    """
+    raw = get_redis().hgetall(f"answer_cache:stats:{clinic_id}")
+    hits = int(raw.get(b"hits", 0))
+    misses = int(raw.get(b"misses", 0))
+    lookups = hits + misses
+    return {
+        "clinic_id": clinic_id,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / lookups if lookups else 0.0,
+        "seconds_saved": float(raw.get(b"seconds_saved", 0.0)),
+    }
+
+
+answer_cache = SemanticAnswerCache(
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+    ttl_seconds=settings.SEMANTIC_CACHE_TTL_SECONDS,
+    max_entries=settings.SEMANTIC_CACHE_MAX_ENTRIES,
+    dimension=settings.EMBEDDING_DIMENSION,
+)
@@ -0,0 +1,153 @@
+import base64
+import csv
+import datetime
+import io
+from typing import AsyncIterator, List, Optional, Tuple
+
+from sqlalchemy import Select, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.chat import ChatHistory, Message
+from app.schemas.chat import ChatMessageOut, ChatMessagePage
+from app.utils.phone import normalize_whatsapp_number
+
+# Admin access to chat history.
+# Messages are listed newest first with keyset pagination on (timestamp, id): the cursor
+# encodes the last row of a page and the next page starts strictly after it, so every page
+# is one range scan of the (clinic_id, timestamp, id) index on the messages, regardless of
+# how deep into the history it is or how many messages other clinics have. Messages
+# without a timestamp can't be placed in that order and are left out of pages (exports
+# list them last). Time bounds are compared in naive UTC, like the stored timestamps.
+# Exports walk the same query oldest first through a server-side cursor and are emitted
+# in batches, so memory use doesn't grow with the size of the history.
+
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_BATCH_SIZE = 1000
+CSV_COLUMNS = ["id", "chat_history_id", "customer_phone", "role", "content", "timestamp"]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp: datetime.datetime, message_id: int) -> str:
+    raw = f"{timestamp.isoformat()}|{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, message_id = raw.split("|")
+        return _naive_utc(datetime.datetime.fromisoformat(timestamp)), int(message_id)
+    except ValueError as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+def _naive_utc(value: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _phone_variants(phone: str) -> List[str]:
+    # Conversations are keyed by the provider address ("whatsapp:+90..."); accept the bare number too.
+    number = normalize_whatsapp_number(phone)
+    return list({phone, number, f"whatsapp:{number}"})
+
+
+def message_query(
+    clinic_id: int,
+    phone: Optional[str] = None,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+) -> Select:
+    """
+    Messages of a clinic's conversations, optionally filtered by customer phone and
+    by a [since, until) time range.
+    """
+    stmt = (
+        select(
+            Message.id,
+            Message.chat_history_id,
+            ChatHistory.customer_phone,
+            Message.role,
+            Message.content,
+            Message.timestamp,
+        )
+        .join(ChatHistory, Message.chat_history_id == ChatHistory.id)
+        .where(Message.clinic_id == clinic_id)
+    )
+    if phone:
+        stmt = stmt.where(ChatHistory.customer_phone.in_(_phone_variants(phone)))
+    if since is not None:
+        stmt = stmt.where(Message.timestamp >= _naive_utc(since))
+    if until is not None:
+        stmt = stmt.where(Message.timestamp < _naive_utc(until))
+    return stmt
+
+
+async def fetch_message_page(
+    session: AsyncSession,
+    clinic_id: int,
+    limit: int,
+    cursor: Optional[str] = None,
+    phone: Optional[str] = None,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+) -> ChatMessagePage:
+    """
+    Returns one page of messages (newest first) following `cursor`.
+    Raises InvalidCursor if the cursor can't be decoded.
+    """
+    stmt = message_query(clinic_id, phone, since, until).where(Message.timestamp.is_not(None))
+    if cursor:
+        timestamp, message_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(Message.timestamp, Message.id) < tuple_(timestamp, message_id))
+    # One extra row tells whether there is a next page without a COUNT query.
+    stmt = stmt.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1)
+
+    rows = (await session.execute(stmt)).all()
+    items = [ChatMessageOut.model_validate(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(last.timestamp, last.id)
+    return ChatMessagePage(items=items, next_cursor=next_cursor)
+
+
+def _format_batch(rows, export_format: str) -> str:
+    if export_format == "ndjson":
+        return "".join(ChatMessageOut.model_validate(row).model_dump_json() + "\n" for row in rows)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(
+        (row.id, row.chat_history_id, row.customer_phone, row.role, row.content, row.timestamp.isoformat() if row.timestamp else "")
+        for row in rows
+    )
+    return buffer.getvalue()
+
+
+async def stream_messages(
+    session_maker,
+    export_format: str,
+    clinic_id: int,
+    phone: Optional[str] = None,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+) -> AsyncIterator[str]:
+    """
+    Yields the filtered messages (oldest first) as NDJSON lines or CSV rows.
+    Opens its own session, because the response body is produced after the request's
+    dependencies have been closed.
+    """
+    if export_format == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(CSV_COLUMNS)
+        yield buffer.getvalue()
+
+    stmt = message_query(clinic_id, phone, since, until).order_by(Message.timestamp, Message.id)
+    async with session_maker() as session:
+        result = await session.stream(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for rows in result.partitions():
+            yield _format_batch(rows, export_format)
@@ -0,0 +1,71 @@
+import threading
+from dataclasses import dataclass, replace
+from typing import Dict, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import selectinload
+
+from app.models.clinic import Clinic
+from app.services.clinic_versions import get_clinic_version_async
+from app.utils.prompt_builder import build_static_prompt
+
+
+@dataclass(frozen=True)
+class ServiceInfo:
+    name: str
+    description: Optional[str]
+    price: Optional[str]
+
+
+@dataclass(frozen=True)
+class ClinicProfile:
+    """
+    Immutable snapshot of the clinic data the AI pipeline needs, together with the
+    static system-prompt prefix built from it. Valid for one clinic configuration version.
+    """
+    id: int
+    name: str
+    ai_tone: str
+    ai_language: str
+    services: Tuple[ServiceInfo, ...]
+    version: int
+    system_prefix: str
+
+
+_profiles: Dict[int, ClinicProfile] = {}
+_lock = threading.Lock()
+
+
+async def get_clinic_profile(session: AsyncSession, clinic_id: int) -> Optional[ClinicProfile]:
+    """
+    Returns the cached profile for the clinic's current version, loading and building
+    it only when the clinic changed (see bump_clinic_version) or isn't cached yet.
+    """
+    version = await get_clinic_version_async(clinic_id)
+    with _lock:
+        cached = _profiles.get(clinic_id)
+    if cached is not None and cached.version == version:
+        return cached
+
+    stmt = select(Clinic).where(Clinic.id == clinic_id).options(selectinload(Clinic.services))
+    result = await session.execute(stmt)
+    clinic = result.scalars().first()
+    if clinic is None:
+        return None
+
+    profile = ClinicProfile(
+        id=clinic.id,
+        name=clinic.name,
+        ai_tone=clinic.ai_tone,
+        ai_language=clinic.ai_language,
+        services=tuple(ServiceInfo(s.name, s.description, s.price) for s in clinic.services),
+        version=version,
+        system_prefix="",
+    )
+    profile = replace(profile, system_prefix=build_static_prompt(profile))
+    with _lock:
+        _profiles[clinic_id] = profile
+    logger.info(f"Built prompt prefix for clinic {clinic_id} (version {version})")
+    return profile
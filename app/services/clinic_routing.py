@@ -0,0 +1,82 @@
+import threading
+import time
+from typing import Dict, Optional
+
+from loguru import logger
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.clinic import Clinic
+from app.services.redis_client import get_redis
+from app.utils.phone import normalize_whatsapp_number
+
+# Routing of provider phone numbers to clinics.
+# Resolved numbers are cached in-process; the cache is dropped whenever the shared
+# routing generation in Redis changes (bumped when a clinic's number is set or changed).
+# The generation is checked at most every ROUTING_CACHE_CHECK_SECONDS, so the common
+# case needs neither a database nor a Redis round-trip. Unknown numbers are only
+# remembered for ROUTING_MISS_CACHE_SECONDS, so a number registered without a
+# generation bump (or before it is seen) is picked up soon anyway.
+ROUTING_GENERATION_KEY = "clinic:routing:generation"
+ROUTING_MAX_MISSES = 10000  # Expired misses are pruned when this many are remembered
+
+
+class ClinicRouter:
+    def __init__(self):
+        self._numbers: Dict[str, Optional[int]] = {}
+        self._misses: Dict[str, float] = {}  # Unknown number -> monotonic time the entry expires
+        self._generation: Optional[int] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _check_generation(self):
+        now = time.monotonic()
+        if now - self._checked_at < settings.ROUTING_CACHE_CHECK_SECONDS:
+            return
+        self._checked_at = now
+        try:
+            generation = int(get_redis().get(ROUTING_GENERATION_KEY) or 0)
+        except Exception as e:
+            logger.warning(f"Could not check clinic routing generation: {e}")
+            return
+        if generation != self._generation:
+            self._numbers.clear()
+            self._misses.clear()
+            self._generation = generation
+
+    def resolve(self, db: Session, provider_number: str) -> Optional[int]:
+        """
+        Returns the ID of the clinic that owns `provider_number`, or DEFAULT_CLINIC_ID
+        (None if not set) if it is unknown.
+        """
+        number = normalize_whatsapp_number(provider_number)
+        with self._lock:
+            self._check_generation()
+            if number in self._numbers:
+                return self._numbers[number]
+            if self._misses.get(number, 0.0) > time.monotonic():
+                return settings.DEFAULT_CLINIC_ID
+
+        clinic_id = db.query(Clinic.id).filter(Clinic.whatsapp_number == number).scalar()
+        with self._lock:
+            if clinic_id is None:
+                now = time.monotonic()
+                if len(self._misses) >= ROUTING_MAX_MISSES:
+                    self._misses = {n: expires for n, expires in self._misses.items() if expires > now}
+                self._misses[number] = now + settings.ROUTING_MISS_CACHE_SECONDS
+                return settings.DEFAULT_CLINIC_ID
+            self._numbers[number] = clinic_id
+        return clinic_id
+
+
+def invalidate_clinic_routing():
+    """
+    Drops every worker's routing cache (on its next generation check).
+    """
+    try:
+        get_redis().incr(ROUTING_GENERATION_KEY)
+    except Exception as e:
+        logger.error(f"Could not invalidate clinic routing cache: {e}")
+
+
+clinic_router = ClinicRouter()
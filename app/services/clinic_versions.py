@@ -0,0 +1,65 @@
+import threading
+import time
+
+from loguru import logger
+
+from app.config import settings
+from app.services.redis_client import get_redis
+from app.utils.concurrency import run_blocking
+
+# Shared, monotonically increasing configuration version per clinic.
+# It is bumped whenever something that affects AI answers changes (clinic settings,
+# services, documents), and per-clinic caches are keyed by it. Readers poll the whole
+# hash at most every CLINIC_VERSION_POLL_SECONDS, so the hot path does not pay a
+# Redis round-trip per message.
+VERSIONS_KEY = "clinic:versions"
+
+_snapshot: dict = {}
+_fetched_at = 0.0
+_lock = threading.Lock()
+
+
+def _refresh_snapshot():
+    global _snapshot, _fetched_at
+    try:
+        raw = get_redis().hgetall(VERSIONS_KEY)
+        _snapshot = {int(k): int(v) for k, v in raw.items()}
+    except Exception as e:
+        logger.warning(f"Could not refresh clinic versions: {e}")
+    _fetched_at = time.monotonic()
+
+
+def get_clinic_version(clinic_id: int) -> int:
+    """
+    Returns the current configuration version of a clinic (0 if never changed).
+    """
+    with _lock:
+        if time.monotonic() - _fetched_at > settings.CLINIC_VERSION_POLL_SECONDS:
+            _refresh_snapshot()
+        return _snapshot.get(clinic_id, 0)
+
+
+async def get_clinic_version_async(clinic_id: int) -> int:
+    """
+    get_clinic_version for async code: when the snapshot is due for a refresh, the Redis
+    call runs on the blocking executor instead of the event loop.
+    """
+    if time.monotonic() - _fetched_at > settings.CLINIC_VERSION_POLL_SECONDS:
+        return await run_blocking(get_clinic_version, clinic_id)
+    with _lock:
+        return _snapshot.get(clinic_id, 0)
+
+
+def bump_clinic_version(clinic_id: int) -> int:
+    """
+    Marks the clinic's configuration as changed, invalidating caches keyed by its version.
+    """
+    try:
+        version = int(get_redis().hincrby(VERSIONS_KEY, clinic_id, 1))
+    except Exception as e:
+        logger.error(f"Could not bump version for clinic {clinic_id}: {e}")
+        return get_clinic_version(clinic_id)
+    with _lock:
+        _snapshot[clinic_id] = version
+    logger.info(f"Clinic {clinic_id} configuration version is now {version}")
+    return version
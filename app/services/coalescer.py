@@ -0,0 +1,129 @@
+import json
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from loguru import logger
+
+from app.config import settings
+from app.services.metrics import BURST_RECOVERIES
+from app.services.redis_client import get_redis
+from app.utils.phone import normalize_whatsapp_number
+
+# Debounce of inbound message bursts per conversation.
+# Messages are appended to a Redis list keyed by (clinic number, customer number).
+# The first message of a burst schedules one flush; the flush waits until the
+# conversation has been quiet for BURST_QUIET_SECONDS (or BURST_MAX_WAIT_SECONDS
+# have passed since the first message) and then merges the burst into one turn.
+#
+# A flush task can be lost (worker crash, broker restart). The `:scheduled` marker is
+# therefore a lease that every run of the flush renews: once it has lapsed, the next
+# message of the conversation schedules a new flush. Bursts that get no further message
+# are found by the overdue sweep every flush runs, through the `burst:pending` index.
+
+PENDING_KEY = "burst:pending"  # Sorted set of open bursts, scored by their first message time
+
+
+@dataclass
+class BurstState:
+    ready: bool
+    delay: float = 0.0
+    messages: List[dict] = field(default_factory=list)
+
+
+def burst_key(message_data: dict) -> str:
+    clinic_number = normalize_whatsapp_number(message_data["To"])
+    customer_number = normalize_whatsapp_number(message_data["From"])
+    return f"burst:{clinic_number}:{customer_number}"
+
+
+def _flush_lease() -> int:
+    # A flush always runs again within BURST_QUIET_SECONDS, plus the time it waits in the queue.
+    return int(settings.BURST_QUIET_SECONDS) + 1 + settings.BURST_FLUSH_GRACE_SECONDS
+
+
+def add_to_burst(message_data: dict) -> Optional[str]:
+    """
+    Buffers an inbound message. Returns the burst key if the caller must schedule
+    a flush for it (first message of a new burst, or a burst whose flush was lost),
+    otherwise None.
+    """
+    key = burst_key(message_data)
+    now = time.time()
+    expiry = int(settings.BURST_MAX_WAIT_SECONDS * 10) + 60
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.rpush(f"{key}:messages", json.dumps(message_data))
+    pipe.expire(f"{key}:messages", expiry)
+    pipe.set(f"{key}:first", now, nx=True, ex=expiry)
+    pipe.set(f"{key}:last", now, ex=expiry)
+    pipe.set(f"{key}:scheduled", 1, nx=True, ex=_flush_lease())
+    pipe.zadd(PENDING_KEY, {key: now}, nx=True)
+    buffered, _, _, _, scheduled, _ = pipe.execute()
+    if not scheduled:
+        return None
+    if buffered > 1:
+        logger.warning(f"Flush of burst {key} was lost; scheduling a new one for {buffered} buffered messages")
+        BURST_RECOVERIES.labels("rearmed").inc()
+    return key
+
+
+def take_burst_if_ready(key: str) -> BurstState:
+    """
+    Returns the buffered messages (and clears the burst) once the quiet window or the
+    maximum wait has elapsed; otherwise returns how long to wait before checking again.
+    """
+    r = get_redis()
+    first, last = r.mget(f"{key}:first", f"{key}:last")
+    now = time.time()
+    if first is not None and last is not None:
+        quiet_left = settings.BURST_QUIET_SECONDS - (now - float(last))
+        max_wait_left = settings.BURST_MAX_WAIT_SECONDS - (now - float(first))
+        if quiet_left > 0 and max_wait_left > 0:
+            r.set(f"{key}:scheduled", 1, ex=_flush_lease())  # The caller schedules the next check
+            return BurstState(ready=False, delay=min(quiet_left, max_wait_left))
+
+    pipe = r.pipeline(transaction=True)
+    pipe.lrange(f"{key}:messages", 0, -1)
+    pipe.delete(f"{key}:messages", f"{key}:first", f"{key}:last", f"{key}:scheduled")
+    pipe.zrem(PENDING_KEY, key)
+    raw_messages, _, _ = pipe.execute()
+    return BurstState(ready=True, messages=[json.loads(m) for m in raw_messages])
+
+
+def rescue_overdue_bursts(limit: int = 100) -> List[str]:
+    """
+    Finds bursts that should have been flushed long ago (their flush task was lost and
+    no new message re-armed it). Returns the keys that still have messages; the caller
+    must schedule a flush for them. Bursts whose messages already expired are dropped,
+    and logged.
+    """
+    r = get_redis()
+    now = time.time()
+    cutoff = now - settings.BURST_MAX_WAIT_SECONDS - settings.BURST_FLUSH_GRACE_SECONDS
+    rescued = []
+    for raw_key in r.zrangebyscore(PENDING_KEY, "-inf", cutoff, start=0, num=limit):
+        key = raw_key.decode()
+        if not r.zrem(PENDING_KEY, key):
+            continue  # Claimed by a concurrent sweep, or flushed in the meantime
+        if r.exists(f"{key}:messages"):
+            # Back in the index, so it is swept again if this flush is lost too.
+            pipe = r.pipeline(transaction=True)
+            pipe.zadd(PENDING_KEY, {key: now}, nx=True)
+            pipe.set(f"{key}:scheduled", 1, ex=_flush_lease())
+            pipe.execute()
+            logger.warning(f"Flush of burst {key} was lost; rescheduling it")
+            BURST_RECOVERIES.labels("rescued").inc()
+            rescued.append(key)
+        else:
+            logger.error(f"Burst {key} expired before it was flushed; its messages were never answered")
+            BURST_RECOVERIES.labels("expired").inc()
+    return rescued
+
+
+def merge_burst(messages: List[dict]) -> dict:
+    """
+    Merges a burst into a single message, keeping the metadata of the latest one.
+    """
+    merged = dict(messages[-1])
+    merged["Body"] = "\n".join(m["Body"] for m in messages if m.get("Body"))
+    return merged
@@ -0,0 +1,100 @@
+import datetime
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Set, Tuple
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.models.document import DocumentChunk, DocumentManifest
+
+# Per-document manifests of indexed chunk hashes (see embed_and_store_text_stream).
+# A manifest is only written after a document has been fully indexed, so it never
+# lists chunks whose vectors are missing.
+# Chunk texts are stored alongside for the keyword index: rows are added page by page
+# as vectors are upserted (and for unchanged chunks of documents indexed before the
+# texts were stored), and removed together with the vectors of deleted chunks.
+# A document is indexed under document_lock, so concurrent uploads of the same file
+# don't diff against the same old manifest (and leave orphan vectors behind).
+
+
+@contextmanager
+def document_lock(engine: Engine, clinic_id: int, filename: str) -> Iterator[None]:
+    """
+    Holds a Postgres advisory lock on (clinic_id, filename) for the duration of the block,
+    on a connection of its own. The lock dies with the connection if the worker does.
+    """
+    params = {"clinic_id": clinic_id, "filename": filename}
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:clinic_id, hashtext(:filename))"), params)
+        conn.commit()  # The lock is session-level; don't sit idle in a transaction while it is held
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:clinic_id, hashtext(:filename))"), params)
+            conn.commit()
+
+
+def load_manifest(db: Session, clinic_id: int, filename: str) -> Set[str]:
+    """
+    Hashes of the chunks indexed for a document; empty if it was never indexed.
+    """
+    hashes = db.execute(
+        select(DocumentManifest.chunk_hashes).where(
+            DocumentManifest.clinic_id == clinic_id,
+            DocumentManifest.filename == filename,
+        )
+    ).scalar()
+    return set(hashes or [])
+
+
+def save_manifest(db: Session, clinic_id: int, filename: str, hashes: Iterable[str]):
+    """
+    Replaces a document's manifest and commits.
+    """
+    chunk_hashes = sorted(hashes)
+    stmt = pg_insert(DocumentManifest).values(clinic_id=clinic_id, filename=filename, chunk_hashes=chunk_hashes)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[DocumentManifest.clinic_id, DocumentManifest.filename],
+        set_={"chunk_hashes": stmt.excluded.chunk_hashes, "updated_at": datetime.datetime.utcnow()},
+    ))
+    db.commit()
+
+
+def load_chunk_hashes(db: Session, clinic_id: int, filename: str) -> Set[str]:
+    """
+    Hashes of the chunks of a document whose text is stored.
+    """
+    return set(db.execute(
+        select(DocumentChunk.chunk_hash).where(
+            DocumentChunk.clinic_id == clinic_id,
+            DocumentChunk.filename == filename,
+        )
+    ).scalars().all())
+
+
+def save_chunks(db: Session, clinic_id: int, filename: str, chunks: List[Tuple[str, str]]):
+    """
+    Stores (chunk_hash, text) pairs of a document and commits. Existing rows are kept.
+    """
+    if not chunks:
+        return
+    rows = [{"clinic_id": clinic_id, "filename": filename, "chunk_hash": digest, "text": text} for digest, text in chunks]
+    db.execute(pg_insert(DocumentChunk).values(rows).on_conflict_do_nothing())
+    db.commit()
+
+
+def delete_chunks(db: Session, clinic_id: int, filename: str, hashes: Iterable[str]):
+    """
+    Deletes the stored texts of a document's removed chunks and commits.
+    """
+    hashes = list(hashes)
+    if not hashes:
+        return
+    db.execute(delete(DocumentChunk).where(
+        DocumentChunk.clinic_id == clinic_id,
+        DocumentChunk.filename == filename,
+        DocumentChunk.chunk_hash.in_(hashes),
+    ))
+    db.commit()
@@ -0,0 +1,106 @@
+import os
+import re
+import uuid
+from typing import BinaryIO, Iterator
+
+from loguru import logger
+
+from app.config import settings
+
+# Out-of-band storage for uploaded documents.
+# The API writes an upload to DOCUMENT_STORAGE_DIR in fixed-size chunks and enqueues only
+# its storage key; the worker then reads the file back incrementally. Document bodies
+# therefore never travel through the broker or sit whole in memory. The directory must
+# be shared by the API and the workers (the same volume in docker-compose).
+
+COPY_CHUNK_BYTES = 1024 * 1024
+READ_CHUNK_CHARS = 64 * 1024
+
+
+class DocumentTooLarge(ValueError):
+    pass
+
+
+def _safe_filename(filename: str) -> str:
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", os.path.basename(filename or "document"))
+    return name[-100:] or "document"
+
+
+def _path(storage_key: str) -> str:
+    root = os.path.abspath(settings.DOCUMENT_STORAGE_DIR)
+    path = os.path.abspath(os.path.join(root, storage_key))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"Invalid storage key: {storage_key}")
+    return path
+
+
+def _new_key(clinic_id: int, filename: str) -> str:
+    return f"clinic_{clinic_id}/{uuid.uuid4().hex}-{_safe_filename(filename)}"
+
+
+def save_document(source: BinaryIO, clinic_id: int, filename: str) -> str:
+    """
+    Copies a binary stream to storage in COPY_CHUNK_BYTES chunks and returns its storage key.
+    Raises DocumentTooLarge (and stores nothing) beyond DOCUMENT_MAX_BYTES.
+    Blocking; call it from a thread when serving requests.
+    """
+    storage_key = _new_key(clinic_id, filename)
+    path = _path(storage_key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.part"
+    written = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = source.read(COPY_CHUNK_BYTES)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > settings.DOCUMENT_MAX_BYTES:
+                    raise DocumentTooLarge(f"Document exceeds {settings.DOCUMENT_MAX_BYTES} bytes")
+                f.write(chunk)
+        # Workers only ever see complete files.
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    logger.info(f"Stored document '{filename}' for clinic {clinic_id} as {storage_key} ({written} bytes)")
+    return storage_key
+
+
+def save_text(content: str, clinic_id: int, filename: str) -> str:
+    """
+    Stores an in-memory document and returns its storage key.
+    """
+    if len(content.encode("utf-8")) > settings.DOCUMENT_MAX_BYTES:
+        raise DocumentTooLarge(f"Document exceeds {settings.DOCUMENT_MAX_BYTES} bytes")
+    storage_key = _new_key(clinic_id, filename)
+    path = _path(storage_key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.part", "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(f"{path}.part", path)
+    return storage_key
+
+
+def iter_document_text(storage_key: str, chunk_chars: int = READ_CHUNK_CHARS) -> Iterator[str]:
+    """
+    Yields a stored document's text in pieces of at most `chunk_chars` characters.
+    Invalid UTF-8 is replaced rather than failing the whole document.
+    """
+    with open(_path(storage_key), encoding="utf-8", errors="replace") as f:
+        while True:
+            piece = f.read(chunk_chars)
+            if not piece:
+                return
+            yield piece
+
+
+def delete_document(storage_key: str):
+    try:
+        os.remove(_path(storage_key))
+    except FileNotFoundError:
+        pass
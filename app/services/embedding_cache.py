@@ -0,0 +1,122 @@
+import hashlib
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+from loguru import logger
+
+from app.config import settings
+from app.services.metrics import CACHE_LOOKUPS
+from app.services.redis_client import get_redis
+
+
+def normalize_query(text: str) -> str:
+    """
+    Normalizes query text so trivially different phrasings share a cache entry.
+    """
+    return " ".join(text.casefold().split())
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for query embeddings.
+
+    - An in-process LRU with TTL (fastest, per worker).
+    - A Redis tier shared by all workers, with TTL-based eviction.
+
+    Keys are derived from the embedding model and the normalized query text.
+    Vectors are stored in Redis as packed float32 to keep entries small.
+    """
+
+    def __init__(self, model: str, max_entries: int, ttl_seconds: int):
+        self.model = model
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> str:
+        digest = hashlib.sha1(normalize_query(text).encode("utf-8")).hexdigest()
+        return f"emb:{self.model}:{digest}"
+
+    def _get_local(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            vector, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return vector
+
+    def _set_local(self, key: str, vector: List[float]):
+        with self._lock:
+            self._entries[key] = (vector, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_shared(self, key: str) -> Optional[List[float]]:
+        try:
+            raw = get_redis().get(key)
+        except Exception as e:
+            logger.warning(f"Embedding cache Redis lookup failed: {e}")
+            return None
+        if raw is None:
+            return None
+        return array("f", raw).tolist()
+
+    def _set_shared(self, key: str, vector: List[float]):
+        try:
+            get_redis().set(key, array("f", vector).tobytes(), ex=self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Embedding cache Redis write failed: {e}")
+
+    def get_or_compute(self, text: str, compute: Callable[[str], List[float]]) -> List[float]:
+        """
+        Returns the cached embedding for `text`, computing and storing it on a miss.
+        """
+        key = self._key(text)
+        vector = self._get_local(key)
+        if vector is not None:
+            self.hits += 1
+            CACHE_LOOKUPS.labels("embedding", "hit").inc()
+            return vector
+
+        vector = self._get_shared(key)
+        if vector is not None:
+            self.redis_hits += 1
+            CACHE_LOOKUPS.labels("embedding", "redis_hit").inc()
+            self._set_local(key, vector)
+            return vector
+
+        self.misses += 1
+        CACHE_LOOKUPS.labels("embedding", "miss").inc()
+        vector = compute(text)
+        self._set_local(key, vector)
+        self._set_shared(key, vector)
+        return vector
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.redis_hits) / lookups if lookups else 0.0,
+            "size": len(self._entries),
+        }
+
+
+query_embedding_cache = EmbeddingCache(
+    model=settings.EMBEDDING_MODEL,
+    max_entries=settings.EMBEDDING_CACHE_SIZE,
+    ttl_seconds=settings.EMBEDDING_CACHE_TTL_SECONDS,
+)
@@ -0,0 +1,125 @@
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import openai
+from loguru import logger
+from sqlalchemy import func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.config import settings
+from app.models.chat import ChatHistory, Message
+from app.services.persistence import pending_messages
+
+
+@dataclass
+class HistoryWindow:
+    """
+    The part of a conversation that goes into the prompt: the last N messages
+    (oldest first) plus the rolling summary of everything before them.
+    """
+    chat_history_id: Optional[int] = None
+    summary: Optional[str] = None
+    messages: List[Message] = field(default_factory=list)
+
+    @property
+    def last_message_at(self):
+        return self.messages[-1].timestamp if self.messages else None
+
+
+async def load_history_window(session: AsyncSession, clinic_id: int, customer_phone: str, limit: int) -> HistoryWindow:
+    """
+    Loads only the last `limit` messages of a conversation with an ordered, limited
+    query served by the (chat_history_id, timestamp) index.
+    """
+    result = await session.execute(
+        select(ChatHistory.id, ChatHistory.summary).where(
+            ChatHistory.clinic_id == clinic_id,
+            ChatHistory.customer_phone == customer_phone,
+        )
+    )
+    row = result.first()
+    if row is None:
+        return HistoryWindow()
+
+    messages_result = await session.execute(
+        select(Message)
+        .where(Message.chat_history_id == row.id)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(limit)
+    )
+    messages = list(reversed(messages_result.scalars().all()))
+    pending = pending_messages(row.id)
+    if pending:
+        # Messages this worker has buffered but not written yet belong to the window too.
+        # Ties are ordered by id like the query above; buffered rows have no id yet and go last.
+        messages = sorted(messages + pending, key=lambda m: (m.timestamp, m.id is None, m.id or 0))[-limit:]
+    return HistoryWindow(chat_history_id=row.id, summary=row.summary, messages=messages)
+
+
+async def summarize_older_messages(session: AsyncSession, chat_history_id: int) -> bool:
+    """
+    Folds messages that have dropped out of the history window into the conversation's
+    rolling summary. Does nothing until at least HISTORY_SUMMARY_MIN_MESSAGES are pending,
+    so the LLM is called once per batch of turns rather than once per message.
+    Returns True if the summary was updated.
+    """
+    chat_history = await session.get(ChatHistory, chat_history_id)
+    if chat_history is None:
+        return False
+
+    # Oldest message still inside the window; everything before it is summarizable.
+    # Bounds compare (timestamp, id), so messages with equal timestamps are neither
+    # skipped nor summarized twice.
+    boundary_result = await session.execute(
+        select(Message.timestamp, Message.id)
+        .where(Message.chat_history_id == chat_history_id)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .offset(settings.HISTORY_WINDOW_MESSAGES - 1)
+        .limit(1)
+    )
+    boundary = boundary_result.first()
+    if boundary is None:
+        return False
+
+    position = tuple_(Message.timestamp, Message.id)
+    conditions = [Message.chat_history_id == chat_history_id, position < tuple_(boundary.timestamp, boundary.id)]
+    if chat_history.summarized_until_id is not None:
+        conditions.append(position > tuple_(chat_history.summarized_until, chat_history.summarized_until_id))
+    elif chat_history.summarized_until is not None:
+        # Summaries written before the id was recorded only have the timestamp.
+        conditions.append(Message.timestamp > chat_history.summarized_until)
+
+    pending_count = (await session.execute(select(func.count()).select_from(Message).where(*conditions))).scalar()
+    if pending_count < settings.HISTORY_SUMMARY_MIN_MESSAGES:
+        return False
+
+    pending_result = await session.execute(
+        select(Message).where(*conditions).order_by(Message.timestamp, Message.id).limit(settings.HISTORY_SUMMARY_MAX_MESSAGES)
+    )
+    pending = pending_result.scalars().all()
+
+    transcript = "\n".join(f"{m.role}: {m.content}" for m in pending)
+    prompt = (
+        "Update the running summary of a conversation between a clinic assistant and a customer. "
+        "Keep facts the assistant may need later (names, requested services, dates, preferences). "
+        "Answer with the updated summary only, in at most 150 words.\n\n"
+        f"Current summary:\n{chat_history.summary or '(none)'}\n\n"
+        f"New messages:\n{transcript}"
+    )
+    try:
+        response = await openai.ChatCompletion.acreate(
+            model=settings.HISTORY_SUMMARY_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.2,
+        )
+    except Exception as e:
+        logger.error(f"Failed to summarize chat history {chat_history_id}: {e}")
+        return False
+
+    chat_history.summary = response.choices[0].message.content.strip()
+    chat_history.summarized_until = pending[-1].timestamp
+    chat_history.summarized_until_id = pending[-1].id
+    await session.commit()
+    logger.info(f"Updated rolling summary for chat history {chat_history_id} ({len(pending)} messages folded in)")
+    return True
@@ -0,0 +1,34 @@
+from loguru import logger
+
+from app.config import settings
+from app.services.redis_client import get_async_redis
+
+# Exactly-once acceptance of provider webhooks.
+# Twilio retries a webhook that was slow or failed, re-sending the same MessageSid.
+# The first delivery claims the SID with an atomic SET NX; later deliveries are dropped.
+
+
+def _key(message_sid: str) -> str:
+    return f"inbound:twilio:{message_sid}"
+
+
+async def claim_inbound_message(message_sid: str) -> bool:
+    """
+    Returns True if this is the first time `message_sid` is seen (within the TTL).
+    Fails open when Redis is unavailable, so messages are never dropped because of it.
+    """
+    try:
+        return bool(await get_async_redis().set(_key(message_sid), 1, nx=True, ex=settings.INBOUND_DEDUP_TTL_SECONDS))
+    except Exception as e:
+        logger.warning(f"Idempotency check failed for {message_sid}, accepting message: {e}")
+        return True
+
+
+async def release_inbound_message(message_sid: str):
+    """
+    Releases a claim, so a provider retry of a message we failed to enqueue is accepted.
+    """
+    try:
+        await get_async_redis().delete(_key(message_sid))
+    except Exception as e:
+        logger.warning(f"Could not release idempotency claim for {message_sid}: {e}")
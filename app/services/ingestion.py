@@ -0,0 +1,157 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple
+
+from loguru import logger
+
+# A vector as accepted by the index: (id, embedding, metadata)
+Vector = Tuple[str, List[float], dict]
+
+
+@dataclass
+class IngestionStats:
+    """
+    Progress and throughput of a single document ingestion.
+    """
+    chunks: int = 0
+    batches: int = 0
+    vectors_upserted: int = 0
+    # Incremental re-indexing: unchanged chunks whose vectors were kept, and removed ones
+    chunks_reused: int = 0
+    vectors_deleted: int = 0
+    chunk_hashes: Set[str] = field(default_factory=set, repr=False)
+    started_at: float = 0.0
+    finished_at: float = 0.0
+
+    @property
+    def seconds(self) -> float:
+        end = self.finished_at or time.perf_counter()
+        return end - self.started_at
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.seconds if self.seconds > 0 else 0.0
+
+
+def iter_batches(chunks: Iterable[str], max_items: int, max_chars: int) -> Iterator[List[str]]:
+    """
+    Groups chunks into batches bounded both by item count and total characters,
+    so a single embedding request never grows too large.
+    """
+    batch: List[str] = []
+    batch_chars = 0
+    for chunk in chunks:
+        if batch and (len(batch) >= max_items or batch_chars + len(chunk) > max_chars):
+            yield batch
+            batch, batch_chars = [], 0
+        batch.append(chunk)
+        batch_chars += len(chunk)
+    if batch:
+        yield batch
+
+
+def iter_split_text(
+    pieces: Iterable[str],
+    split: Callable[[str], List[str]],
+    window_chars: int = 16000,
+) -> Iterator[str]:
+    """
+    Splits a text that arrives in pieces into chunks without materializing it.
+
+    Text is accumulated into windows of about `window_chars` characters and each window
+    is split with `split`. All chunks but the last are emitted; the last one may continue
+    in the next piece, so it is carried over and split again together with the following
+    text. Memory use is bounded by the window size, not by the document size.
+    """
+    carry = ""
+    for piece in pieces:
+        carry += piece
+        if len(carry) < window_chars:
+            continue
+        chunks = split(carry)
+        if len(chunks) < 2:
+            continue  # a single chunk can't be cut yet; keep accumulating
+        yield from chunks[:-1]
+        # Keep the raw text from the start of the last chunk, including any separator
+        # after it that the splitter stripped.
+        start = carry.rfind(chunks[-1])
+        carry = carry[start:] if start >= 0 else chunks[-1]
+    if carry.strip():
+        yield from split(carry)
+
+
+class IngestionPipeline:
+    """
+    Embeds document chunks in size-bounded batches with limited concurrency and
+    streams the resulting vectors to the index in fixed-size upsert pages.
+
+    `embed_batch` turns a list of texts into a list of embeddings, `upsert_page`
+    writes a list of vectors to the index and `make_vector` builds the
+    (id, embedding, metadata) tuple for the chunk at a given position.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        upsert_page: Callable[[List[Vector]], None],
+        make_vector: Callable[[int, str, List[float]], Vector],
+        batch_size: int = 64,
+        batch_max_chars: int = 64000,
+        concurrency: int = 4,
+        upsert_page_size: int = 100,
+        on_progress: Optional[Callable[[IngestionStats], None]] = None,
+    ):
+        self.embed_batch = embed_batch
+        self.upsert_page = upsert_page
+        self.make_vector = make_vector
+        self.batch_size = batch_size
+        self.batch_max_chars = batch_max_chars
+        self.concurrency = concurrency
+        self.upsert_page_size = upsert_page_size
+        self.on_progress = on_progress
+
+    def run(self, chunks: Iterable[str]) -> IngestionStats:
+        stats = IngestionStats(started_at=time.perf_counter())
+        pending_vectors: List[Vector] = []
+        in_flight: dict = {}
+
+        def collect(future: Future):
+            offset, batch = in_flight.pop(future)
+            vectors = future.result()
+            for i, (chunk, embedding) in enumerate(zip(batch, vectors)):
+                pending_vectors.append(self.make_vector(offset + i, chunk, embedding))
+            stats.batches += 1
+            while len(pending_vectors) >= self.upsert_page_size:
+                self._flush(pending_vectors[:self.upsert_page_size], stats)
+                del pending_vectors[:self.upsert_page_size]
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="ingest") as executor:
+            offset = 0
+            for batch in iter_batches(chunks, self.batch_size, self.batch_max_chars):
+                # Keep at most `concurrency` batches in flight so memory stays bounded
+                # even when chunks come from a lazy generator.
+                while len(in_flight) >= self.concurrency:
+                    done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+                in_flight[executor.submit(self.embed_batch, batch)] = (offset, batch)
+                offset += len(batch)
+                stats.chunks = offset
+
+            while in_flight:
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+
+        if pending_vectors:
+            self._flush(pending_vectors, stats)
+        stats.finished_at = time.perf_counter()
+        return stats
+
+    def _flush(self, page: List[Vector], stats: IngestionStats):
+        self.upsert_page(page)
+        stats.vectors_upserted += len(page)
+        if self.on_progress:
+            self.on_progress(stats)
+        logger.debug(f"Upserted {stats.vectors_upserted}/{stats.chunks} vectors ({stats.chunks_per_second:.1f} chunks/s)")
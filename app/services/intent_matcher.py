@@ -0,0 +1,190 @@
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from app.config import settings
+from app.services.clinic_profile import ClinicProfile, ServiceInfo
+from app.services.lexical_index import tokenize
+
+# Structured-data fast path.
+# Many messages are plain lookups against the clinic's own data ("botox price",
+# "what services do you offer?"). They are recognized here with keyword cues and
+# answered from a template in the clinic's language, without retrieval or the LLM.
+# The matcher is deliberately conservative: anything it can't explain (a second
+# service, extra words, a language without templates, missing data) falls back to
+# the LLM, and every outcome is counted so the cues can be tuned from the metrics.
+
+
+def _normalized(words: str) -> FrozenSet[str]:
+    return frozenset(tokenize(words))
+
+
+@dataclass(frozen=True)
+class Cues:
+    words: FrozenSet[str]  # Matched as whole tokens ("what" must not match "whatsapp")
+    stems: FrozenSet[str]  # Matched as prefixes, so Turkish suffixes ("fiyatı", "hizmetleriniz") match too
+
+
+def _cues(words: str, stems: str) -> Cues:
+    return Cues(_normalized(words), _normalized(stems))
+
+
+PRICE_CUES = _cues(
+    "price prices pricing cost costs fee fees charge charges much",
+    "fiyat ücret kaç para tutar kadar",
+)
+INFO_CUES = _cues(
+    "what about info information describe explain detail details",
+    "nedir hakkında bilgi nasıl",
+)
+LIST_CUES = _cues(
+    "service services treatment treatments procedure procedures offer offers menu",
+    "hizmet tedavi işlem uygulama neler",
+)
+# Filler words that don't change the meaning of a lookup (matched exactly).
+STOPWORDS = _normalized(
+    "hi hello hey the an is are of for how do does you your can could tell me please want would like to know "
+    "at in on it this that there any have get "
+    "merhaba selam iyi günler acaba lütfen bir ne mi mı mu mü var sizin sizde için bu şu ve ile "
+    "alabilir miyim almak istiyorum öğrenmek"
+)
+
+TEMPLATES: Dict[str, Dict[str, str]] = {
+    "en": {
+        "price": "The price of {name} at {clinic} is {price}.",
+        "service_info": "{name}: {description}.",
+        "service_info_price": "{name}: {description}. Price: {price}.",
+        "service_list": "Here are the services we offer at {clinic}:\n{services}",
+        "closing": "Let us know if you'd like to book an appointment.",
+    },
+    "tr": {
+        "price": "{clinic} kliniğimizde {name} ücreti {price}.",
+        "service_info": "{name}: {description}.",
+        "service_info_price": "{name}: {description}. Ücret: {price}.",
+        "service_list": "{clinic} olarak sunduğumuz hizmetler:\n{services}",
+        "closing": "Randevu almak isterseniz yardımcı olabiliriz.",
+    },
+}
+LANGUAGE_ALIASES = {
+    "en": _normalized("en english ingilizce"),
+    "tr": _normalized("tr turkish türkçe"),
+}
+
+
+@dataclass
+class IntentMatch:
+    intent: str  # "price", "service_info", "service_list" or "none"
+    result: str  # "answered", or why the message was left to the LLM
+    answer: Optional[str] = None
+
+
+def template_language(ai_language: str) -> Optional[str]:
+    tokens = tokenize(ai_language or "")
+    if not tokens:
+        return None
+    for language, aliases in LANGUAGE_ALIASES.items():
+        if tokens[0] in aliases:
+            return language
+    return None
+
+
+def _is_cue(token: str, *cue_sets: Cues) -> bool:
+    return any(token in cues.words or any(token.startswith(stem) for stem in cues.stems) for cues in cue_sets)
+
+
+def _covers(token: str, name_token: str) -> bool:
+    return token == name_token or (len(name_token) >= 3 and token.startswith(name_token))
+
+
+def _match_services(tokens: List[str], services: Sequence[ServiceInfo]) -> Tuple[List[ServiceInfo], set]:
+    """
+    Services whose whole name appears in the message, without those whose name is part
+    of a longer matched name ("Botox" when "Botox Lips" matched). Also returns the
+    positions of the message tokens covered by the returned names.
+    """
+    matched = []
+    for service in services:
+        name_tokens = frozenset(tokenize(service.name))
+        if not name_tokens:
+            continue
+        positions = set()
+        for name_token in name_tokens:
+            hits = [i for i, token in enumerate(tokens) if _covers(token, name_token)]
+            if not hits:
+                break
+            positions.update(hits)
+        else:
+            matched.append((service, name_tokens, positions))
+    kept = [m for m in matched if not any(m[1] < other[1] for other in matched)]
+    covered = set().union(*(positions for _, _, positions in kept)) if kept else set()
+    return [service for service, _, _ in kept], covered
+
+
+def _price(service: ServiceInfo) -> Optional[str]:
+    return (service.price or "").strip() or None
+
+
+def _description(service: ServiceInfo) -> Optional[str]:
+    return (service.description or "").strip().rstrip(".") or None
+
+
+def _render(language: str, intent: str, clinic: ClinicProfile, service: Optional[ServiceInfo]) -> Optional[str]:
+    templates = TEMPLATES[language]
+    if intent == "price":
+        if _price(service) is None:
+            return None
+        body = templates["price"].format(name=service.name, clinic=clinic.name, price=_price(service))
+    elif intent == "service_info":
+        if _description(service) is None:
+            return None
+        key = "service_info_price" if _price(service) else "service_info"
+        body = templates[key].format(name=service.name, description=_description(service), price=_price(service))
+    else:
+        if not clinic.services:
+            return None
+        lines = "\n".join(
+            f"- {s.name} ({_price(s)})" if _price(s) else f"- {s.name}" for s in clinic.services
+        )
+        body = templates["service_list"].format(clinic=clinic.name, services=lines)
+    return f"{body}\n{templates['closing']}"
+
+
+def match_structured_intent(clinic: ClinicProfile, message: str) -> IntentMatch:
+    """
+    Recognizes price, service description and service list questions about the clinic
+    and answers them from its service data. `answer` is None when the message should go
+    to the LLM; `result` then says why.
+    """
+    tokens = tokenize(message)
+    if not tokens or len(tokens) > settings.INTENT_MAX_TOKENS:
+        return IntentMatch("none", "no_intent")
+
+    services, covered = _match_services(tokens, clinic.services)
+    asks_price = any(_is_cue(t, PRICE_CUES) for t in tokens)
+    asks_list = any(_is_cue(t, LIST_CUES) for t in tokens)
+
+    if len(services) > 1:
+        return IntentMatch("price" if asks_price else "service_info", "ambiguous")
+    if services:
+        intent = "price" if asks_price else "service_info"
+    elif asks_list:
+        intent = "service_list"
+    else:
+        return IntentMatch("none", "no_intent")
+
+    # Words that are neither the service name, a cue nor filler may change the question
+    # ("is botox painful?", "botox price for two areas"), so by default none are tolerated.
+    unexplained = [
+        t for i, t in enumerate(tokens)
+        if i not in covered and t not in STOPWORDS and not _is_cue(t, PRICE_CUES, INFO_CUES, LIST_CUES)
+    ]
+    if len(unexplained) > settings.INTENT_MAX_UNMATCHED_TOKENS:
+        return IntentMatch(intent, "unsure")
+
+    language = template_language(clinic.ai_language)
+    if language is None:
+        return IntentMatch(intent, "unsupported_language")
+
+    answer = _render(language, intent, clinic, services[0] if services else None)
+    if answer is None:
+        return IntentMatch(intent, "missing_data")
+    return IntentMatch(intent, "answered", answer)
@@ -0,0 +1,162 @@
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from loguru import logger
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.models.document import DocumentChunk
+from app.services.clinic_profile import ClinicProfile
+from app.utils.concurrency import run_blocking
+from app.utils.prompt_builder import format_service_line
+
+# Per-clinic keyword (BM25) index over the clinic's service lines and document chunks.
+# Short keyword-style messages ("botox price") often contain the literal text of the
+# answer, which BM25 finds in microseconds without an embedding call. Chunk texts are
+# stored in the database as documents are ingested (see document_manifest.save_chunks);
+# each process builds the index from them once per clinic version, so a re-upload or a
+# service change (both bump the version) is picked up on the next message.
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word tokens with accents stripped, so "Dolgu", "dolgu" and "dölgu" match.
+    Single letters are dropped; single digits are kept (prices, durations).
+    """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return [token for token in _TOKEN_RE.findall(text) if len(token) > 1 or token.isdigit()]
+
+
+@dataclass
+class LexicalMatch:
+    text: str
+    score: float
+    coverage: float  # Fraction of the distinct query terms found in the text
+
+
+@dataclass
+class LexicalResult:
+    query_terms: int
+    matches: List[LexicalMatch] = field(default_factory=list)
+
+    @property
+    def confident(self) -> bool:
+        """
+        Whether the top match is clear enough to be used without vector search: a short
+        query, all of whose terms appear in the top text, which outscores the runner-up
+        by a wide margin.
+        """
+        if not self.matches or self.query_terms > settings.LEXICAL_FASTPATH_MAX_TERMS:
+            return False
+        top = self.matches[0]
+        if top.coverage < settings.LEXICAL_FASTPATH_MIN_COVERAGE:
+            return False
+        return len(self.matches) == 1 or top.score >= settings.LEXICAL_FASTPATH_MIN_MARGIN * self.matches[1].score
+
+
+class LexicalIndex:
+    """
+    Immutable in-memory BM25 index over a set of texts, valid for one clinic version.
+    """
+
+    def __init__(self, texts: Sequence[str], version: int):
+        self.version = version
+        self.texts = list(dict.fromkeys(texts))
+        self._lengths: List[int] = []
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        for doc_id, text in enumerate(self.texts):
+            counts = Counter(tokenize(text))
+            self._lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                self._postings.setdefault(term, []).append((doc_id, frequency))
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        size = len(self.texts)
+        self._idf = {
+            term: math.log(1 + (size - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def search(self, query: str, top_k: int) -> LexicalResult:
+        terms = set(tokenize(query))
+        scores: Dict[int, float] = {}
+        matched: Counter = Counter()
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf[term]
+            for doc_id, frequency in postings:
+                length_norm = 1 - BM25_B + BM25_B * self._lengths[doc_id] / self._avg_length
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+                matched[doc_id] += 1
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return LexicalResult(
+            query_terms=len(terms),
+            matches=[LexicalMatch(self.texts[doc_id], score, matched[doc_id] / len(terms)) for doc_id, score in best],
+        )
+
+
+def fuse_rankings(rankings: Sequence[Sequence[str]], top_k: int) -> List[str]:
+    """
+    Reciprocal rank fusion of several rankings of texts. Ties keep the order of the
+    first ranking a text appears in.
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, text in enumerate(ranking):
+            scores[text] = scores.get(text, 0.0) + 1.0 / (settings.RRF_K + rank + 1)
+    return sorted(scores, key=lambda text: -scores[text])[:top_k]
+
+
+_indexes: "OrderedDict[int, LexicalIndex]" = OrderedDict()
+_lock = threading.Lock()
+
+
+async def get_lexical_index(session: AsyncSession, clinic: ClinicProfile) -> Optional[LexicalIndex]:
+    """
+    Returns the clinic's keyword index for the profile's version, building it on a miss.
+    Returns None if it can't be loaded; retrieval then falls back to vector search only.
+    """
+    with _lock:
+        cached = _indexes.get(clinic.id)
+        if cached is not None and cached.version == clinic.version:
+            _indexes.move_to_end(clinic.id)
+            return cached
+
+    try:
+        result = await session.execute(
+            select(DocumentChunk.text)
+            .where(DocumentChunk.clinic_id == clinic.id)
+            .order_by(DocumentChunk.filename, DocumentChunk.chunk_hash)
+        )
+        texts = [format_service_line(service) for service in clinic.services] + list(result.scalars().all())
+        # Tokenizing a large document set is CPU-bound, so keep it off the event loop.
+        index = await run_blocking(LexicalIndex, texts, clinic.version)
+    except Exception as e:
+        logger.error(f"Failed to build the keyword index for clinic {clinic.id}: {e}")
+        await session.rollback()  # The session is still used for the rest of the turn
+        return None
+
+    with _lock:
+        _indexes[clinic.id] = index
+        _indexes.move_to_end(clinic.id)
+        while len(_indexes) > settings.LEXICAL_INDEX_MAX_CLINICS:
+            _indexes.popitem(last=False)
+    logger.info(f"Built keyword index for clinic {clinic.id} (version {clinic.version}, {len(index)} texts)")
+    return index
@@ -0,0 +1,168 @@
+import asyncio
+import glob
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Prometheus metrics for the message hot path.
+# API and Celery worker processes record into the same metric families. When
+# PROMETHEUS_MULTIPROC_DIR is set, every process writes its samples there. Each service
+# (container) needs a directory of its own, emptied when the service starts (see
+# docker-entrypoint.sh): PIDs of different containers overlap, and files of a previous
+# run would otherwise be counted forever. /metrics in the API aggregates the samples
+# of every process of every service found under PROMETHEUS_AGGREGATE_DIR (by default
+# only its own PROMETHEUS_MULTIPROC_DIR).
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+STAGE_LATENCY = Histogram(
+    "clinic_assistant_stage_seconds",
+    "Latency of a pipeline stage.",
+    ["stage", "clinic_id"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "clinic_assistant_stage_errors_total",
+    "Errors raised by a pipeline stage.",
+    ["stage", "clinic_id"],
+)
+MESSAGE_BUFFER_DROPPED = Counter(
+    "clinic_assistant_message_buffer_dropped_total",
+    "Buffered message rows and turns dropped without being written, by reason "
+    "(dead_letter: rejected by the database, overflow: buffer full, shutdown: unwritten "
+    "on shutdown; the last two only when Redis is unreachable too).",
+    ["reason"],
+)
+MESSAGE_BUFFER_SPILLED = Counter(
+    "clinic_assistant_message_buffer_spilled_total",
+    "Buffered message rows and turns spilled to Redis to be written later, by reason "
+    "(overflow: buffer full, shutdown: unwritten on shutdown).",
+    ["reason"],
+)
+BURST_RECOVERIES = Counter(
+    "clinic_assistant_burst_recoveries_total",
+    "Message bursts whose scheduled flush was lost, by outcome (rearmed: by a new message, "
+    "rescued: by the overdue sweep, expired: the messages expired before they were flushed).",
+    ["result"],
+)
+QUEUE_WAIT = Histogram(
+    "clinic_assistant_queue_wait_seconds",
+    "Time a message task waited in the Celery queue before a worker picked it up.",
+    ["clinic_id"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "clinic_assistant_llm_tokens_total",
+    "Tokens billed by the LLM provider.",
+    ["kind", "clinic_id"],
+)
+PROMPT_SECTION_TOKENS = Histogram(
+    "clinic_assistant_prompt_section_tokens",
+    "Tokens used by each prompt section per request.",
+    ["section", "clinic_id"],
+    buckets=TOKEN_BUCKETS,
+)
+CACHE_LOOKUPS = Counter(
+    "clinic_assistant_cache_lookups_total",
+    "Cache lookups by cache and result.",
+    ["cache", "result"],
+)
+RETRIEVAL_PATH = Counter(
+    "clinic_assistant_retrieval_path_total",
+    "RAG retrievals by path: lexical_fast_path (no embedding call), hybrid or vector.",
+    ["path"],
+)
+INTENT_FASTPATH = Counter(
+    "clinic_assistant_intent_fastpath_total",
+    "Messages checked by the structured-data fast path, by intent and result "
+    "(answered, or the reason it fell back to the LLM).",
+    ["intent", "result"],
+)
+LLM_SECONDS_SAVED = Counter(
+    "clinic_assistant_llm_seconds_saved_total",
+    "LLM latency avoided by answering from the semantic cache.",
+    ["clinic_id"],
+)
+STREAM_TIME_TO_FIRST_TOKEN = Histogram(
+    "clinic_assistant_stream_ttft_seconds",
+    "Time from request to the first streamed token.",
+    ["clinic_id"],
+    buckets=LATENCY_BUCKETS,
+)
+STREAM_TOKENS_PER_SECOND = Histogram(
+    "clinic_assistant_stream_tokens_per_second",
+    "Completion throughput of streamed replies.",
+    ["clinic_id"],
+    buckets=(5, 10, 20, 40, 60, 80, 100, 150, 200),
+)
+
+
+def clinic_label(clinic_id: Optional[int]) -> str:
+    return str(clinic_id) if clinic_id is not None else "unknown"
+
+
+@contextmanager
+def track_stage(stage: str, clinic_id: Optional[int] = None):
+    """
+    Records the latency of the enclosed block, and an error if it raises.
+    Works around awaits as well, so it can be used inside coroutines.
+    """
+    label = clinic_label(clinic_id)
+    started = time.perf_counter()
+    try:
+        yield
+    except asyncio.CancelledError:
+        raise  # Abandoned, not failed (e.g. retrieval cancelled on a cache hit); not a full latency sample either
+    except BaseException:
+        STAGE_ERRORS.labels(stage, label).inc()
+        STAGE_LATENCY.labels(stage, label).observe(time.perf_counter() - started)
+        raise
+    STAGE_LATENCY.labels(stage, label).observe(time.perf_counter() - started)
+
+
+class _AggregateCollector:
+    """
+    Merges the multiprocess metric files of all services below one directory.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def collect(self):
+        files = glob.glob(os.path.join(self.root, "**", "*.db"), recursive=True)
+        return multiprocess.MultiProcessCollector.merge(files, accumulate=True)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    Returns the metrics of this process (or of all processes in multiprocess mode)
+    in the Prometheus text format.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        root = os.environ.get("PROMETHEUS_AGGREGATE_DIR") or os.environ["PROMETHEUS_MULTIPROC_DIR"]
+        registry.register(_AggregateCollector(root))
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    """
+    Drops the live-gauge samples of an exited process (multiprocess mode only).
+    Counters and histograms of the process are kept, as Prometheus expects.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
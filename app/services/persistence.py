@@ -0,0 +1,369 @@
+import atexit
+import datetime
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict
+from typing import Callable, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.chat import ChatHistory, Message
+from app.services.analytics import TurnStats, write_rollups, write_rollups_async
+from app.services.metrics import MESSAGE_BUFFER_DROPPED, MESSAGE_BUFFER_SPILLED
+from app.services.redis_client import get_redis
+
+# Write path for conversations.
+# - Conversations are upserted on the unique (clinic_id, customer_phone) key in a single
+#   statement, and their ids are cached in-process, so known conversations cost no round-trip.
+# - Message rows are buffered and written with multi-row INSERTs, flushed when the buffer
+#   reaches MESSAGE_FLUSH_SIZE rows or every MESSAGE_FLUSH_INTERVAL_SECONDS, and on worker
+#   shutdown. Until flushed, buffered rows are visible to this process through `pending()`.
+#   If a bulk INSERT fails, the rows are retried one by one and the ones that still fail
+#   with a data error (e.g. a conversation deleted since its id was cached) are logged and
+#   dropped, so one bad row can't block the buffer.
+# - Rows the buffer can't hold are spilled to a Redis list instead of being dropped: the
+#   oldest rows beyond MESSAGE_BUFFER_MAX_ROWS (while the database is unreachable) and
+#   whatever is still unwritten on worker shutdown. Any worker whose flushes succeed
+#   moves spilled rows back into its buffer, so they are written once the database is
+#   back, also after a restart. Only a worker killed outright (SIGKILL, OOM) still loses
+#   the rows of its last MESSAGE_FLUSH_INTERVAL_SECONDS.
+# - Analytics rollups of the buffered turns are written in the same transaction as the
+#   messages (see app/services/analytics.py).
+
+SPILL_KEY = "message_buffer:spill"
+
+_chat_history_ids: "OrderedDict[tuple[int, str], int]" = OrderedDict()
+_chat_history_ids_lock = threading.Lock()
+
+
+def _upsert_chat_history_stmt(clinic_id: int, customer_phone: str):
+    stmt = pg_insert(ChatHistory).values(clinic_id=clinic_id, customer_phone=customer_phone)
+    # A no-op update makes RETURNING yield the existing row's id on conflict.
+    return stmt.on_conflict_do_update(
+        index_elements=[ChatHistory.clinic_id, ChatHistory.customer_phone],
+        set_={"customer_phone": stmt.excluded.customer_phone},
+    ).returning(ChatHistory.id)
+
+
+def upsert_chat_history(db: Session, clinic_id: int, customer_phone: str) -> int:
+    """
+    Returns the id of the conversation, creating it atomically if it doesn't exist.
+    """
+    key = (clinic_id, customer_phone)
+    with _chat_history_ids_lock:
+        chat_history_id = _chat_history_ids.get(key)
+        if chat_history_id is not None:
+            _chat_history_ids.move_to_end(key)
+            return chat_history_id
+
+    chat_history_id = db.execute(_upsert_chat_history_stmt(clinic_id, customer_phone)).scalar_one()
+    db.commit()
+
+    with _chat_history_ids_lock:
+        _chat_history_ids[key] = chat_history_id
+        while len(_chat_history_ids) > settings.CHAT_HISTORY_ID_CACHE_SIZE:
+            _chat_history_ids.popitem(last=False)
+    return chat_history_id
+
+
+def forget_chat_history(chat_history_id: int):
+    """
+    Drops a conversation id from the cache, e.g. after writes to it failed because it was deleted.
+    """
+    with _chat_history_ids_lock:
+        for key in [k for k, v in _chat_history_ids.items() if v == chat_history_id]:
+            del _chat_history_ids[key]
+
+
+async def persist_turn(
+    session: AsyncSession,
+    clinic_id: int,
+    customer_phone: str,
+    user_message: str,
+    reply: str,
+    received_at: datetime.datetime,
+    stats: Optional[TurnStats] = None,
+):
+    """
+    Writes one user/assistant turn directly (used by the API process, which has no write buffer):
+    one conversation upsert and one multi-row message insert in a single transaction,
+    together with the turn's analytics rollups when `stats` is given.
+    """
+    chat_history_id = (await session.execute(_upsert_chat_history_stmt(clinic_id, customer_phone))).scalar_one()
+    await session.execute(insert(Message), [
+        {"chat_history_id": chat_history_id, "clinic_id": clinic_id, "role": "user", "content": user_message, "timestamp": received_at},
+        {"chat_history_id": chat_history_id, "clinic_id": clinic_id, "role": "assistant", "content": reply, "timestamp": datetime.datetime.utcnow()},
+    ])
+    if stats is not None and settings.ANALYTICS_ROLLUPS_ENABLED:
+        await write_rollups_async(session, [stats])
+    await session.commit()
+
+
+def _spill_record(kind: str, entry: dict) -> str:
+    return json.dumps({"kind": kind, **entry}, default=datetime.datetime.isoformat)
+
+
+def _load_spill_record(raw: bytes) -> Tuple[str, dict]:
+    entry = json.loads(raw)
+    kind = entry.pop("kind")
+    key = "timestamp" if kind == "message" else "received_at"
+    entry[key] = datetime.datetime.fromisoformat(entry[key])
+    return kind, entry
+
+
+class MessageWriteBuffer:
+    """
+    Buffers Message rows (and the analytics of their turns) and writes them in bulk
+    from a background thread.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], max_rows: int, interval_seconds: float, capacity: int):
+        self.session_factory = session_factory
+        self.max_rows = max_rows
+        self.interval_seconds = interval_seconds
+        self.capacity = capacity
+        self._rows: List[dict] = []
+        self._turns: List[TurnStats] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._writable: Optional[bool] = None  # Whether the last flush reached the database (None: no flush yet)
+        self._next_replay = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="message-write-buffer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def add(self, chat_history_id: int, role: str, content: str, timestamp: datetime.datetime = None, clinic_id: Optional[int] = None):
+        row = {
+            "chat_history_id": chat_history_id,
+            "clinic_id": clinic_id,
+            "role": role,
+            "content": content,
+            "timestamp": timestamp or datetime.datetime.utcnow(),
+        }
+        with self._lock:
+            self._rows.append(row)
+            overflow = self._take_overflow()
+            full = len(self._rows) >= self.max_rows
+        self._spill(*overflow, reason="overflow")
+        if full:
+            self._wakeup.set()
+        self.start()
+
+    def record_turn(self, stats: TurnStats):
+        """
+        Buffers a completed turn for the analytics rollups; written with the next flush.
+        """
+        if not settings.ANALYTICS_ROLLUPS_ENABLED:
+            return
+        with self._lock:
+            self._turns.append(stats)
+            overflow = self._take_overflow()
+        self._spill(*overflow, reason="overflow")
+        self.start()
+
+    def _take_overflow(self) -> Tuple[List[dict], List[TurnStats]]:
+        # Called with self._lock held. Removes and returns the oldest entries beyond the capacity.
+        rows = self._rows[:max(0, len(self._rows) - self.capacity)]
+        turns = self._turns[:max(0, len(self._turns) - self.capacity)]
+        del self._rows[:len(rows)]
+        del self._turns[:len(turns)]
+        return rows, turns
+
+    def _spill(self, rows: List[dict], turns: List[TurnStats], reason: str):
+        """
+        Appends entries the buffer can't write or hold to the Redis spill list.
+        They are only dropped (and logged) if Redis is unreachable too.
+        """
+        if not rows and not turns:
+            return
+        records = [_spill_record("message", row) for row in rows] + [_spill_record("turn", asdict(t)) for t in turns]
+        try:
+            get_redis().rpush(SPILL_KEY, *records)
+        except Exception as e:
+            MESSAGE_BUFFER_DROPPED.labels(reason).inc(len(records))
+            logger.error(f"Dropped {len(rows)} buffered messages and {len(turns)} turns ({reason}), Redis is unreachable too: {e}")
+            return
+        MESSAGE_BUFFER_SPILLED.labels(reason).inc(len(records))
+        logger.warning(f"Spilled {len(rows)} buffered messages and {len(turns)} turns to Redis ({reason})")
+
+    def replay_spilled(self) -> int:
+        """
+        Moves spilled entries back into the buffer, as many as it has room for.
+        Returns the number of entries taken.
+        """
+        with self._lock:
+            room = self.capacity - max(len(self._rows), len(self._turns))
+        if room <= 0:
+            return 0
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.lrange(SPILL_KEY, 0, room - 1)
+        pipe.ltrim(SPILL_KEY, room, -1)
+        records, _ = pipe.execute()
+        if not records:
+            return 0
+        rows, turns = [], []
+        for raw in records:
+            kind, entry = _load_spill_record(raw)
+            if kind == "message":
+                rows.append(entry)
+            else:
+                turns.append(TurnStats(**entry))
+        with self._lock:
+            self._rows[:0] = rows
+            self._turns[:0] = turns
+        logger.info(f"Replaying {len(rows)} spilled messages and {len(turns)} turns")
+        self._wakeup.set()
+        return len(records)
+
+    def pending(self, chat_history_id: int) -> List[Message]:
+        """
+        Buffered, not yet written messages of a conversation, as transient Message objects.
+        """
+        with self._lock:
+            rows = [r for r in self._rows if r["chat_history_id"] == chat_history_id]
+        return [Message(**row) for row in rows]
+
+    def flush(self) -> int:
+        """
+        Writes all buffered rows with one multi-row INSERT, and the buffered turns'
+        rollups, in one transaction. If that fails, falls back to `_write_one_by_one`.
+        Returns the number of message rows written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+                turns, self._turns = self._turns, []
+            if not rows and not turns:
+                return 0
+            db = self.session_factory()
+            try:
+                if rows:
+                    db.execute(insert(Message), rows)
+                write_rollups(db, turns)
+                db.commit()
+                self._writable = True
+                return len(rows)
+            except Exception as e:
+                db.rollback()
+                logger.warning(f"Bulk flush of {len(rows)} buffered messages failed, retrying one by one: {e}")
+            finally:
+                db.close()
+            return self._write_one_by_one(rows, turns)
+
+    def _write_one_by_one(self, rows: List[dict], turns: List[TurnStats]) -> int:
+        """
+        Writes every row and turn in its own savepoint. Entries rejected by the database
+        (integrity or data errors) are dead-lettered: logged and dropped. Any other error
+        (e.g. the database is unreachable) puts everything back for the next flush.
+        """
+        db = self.session_factory()
+        written = 0
+        try:
+            for row in rows:
+                try:
+                    with db.begin_nested():
+                        db.execute(insert(Message), [row])
+                    written += 1
+                except (IntegrityError, DataError) as e:
+                    self._dead_letter(f"message of conversation {row['chat_history_id']} ({row['role']}, {row['timestamp']})", e)
+                    forget_chat_history(row["chat_history_id"])
+            for turn in turns:
+                try:
+                    with db.begin_nested():
+                        write_rollups(db, [turn])
+                except (IntegrityError, DataError) as e:
+                    self._dead_letter(f"analytics of a turn of clinic {turn.clinic_id} at {turn.received_at}", e)
+            db.commit()
+            self._writable = True
+            return written
+        except Exception as e:
+            db.rollback()
+            self._writable = False
+            logger.error(f"Failed to flush {len(rows)} buffered messages: {e}")
+            with self._lock:
+                self._rows[:0] = rows
+                self._turns[:0] = turns
+                overflow = self._take_overflow()
+            self._spill(*overflow, reason="overflow")
+            return 0
+        finally:
+            db.close()
+
+    def _dead_letter(self, what: str, error: Exception):
+        MESSAGE_BUFFER_DROPPED.labels("dead_letter").inc()
+        logger.error(f"Dropping buffered {what}: {error}")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval_seconds)
+            self._wakeup.clear()
+            self.flush()
+            self._maybe_replay()
+
+    def _maybe_replay(self):
+        # Spilled entries are taken back at startup and while the database accepts writes.
+        if self._writable is False or self._stopped.is_set() or time.monotonic() < self._next_replay:
+            return
+        self._next_replay = time.monotonic() + settings.MESSAGE_SPILL_REPLAY_INTERVAL_SECONDS
+        try:
+            self.replay_spilled()
+        except Exception as e:
+            logger.warning(f"Could not replay spilled messages: {e}")
+
+    def close(self):
+        """
+        Stops the flush thread and writes whatever is still buffered, spilling what
+        can't be written to Redis. Called on worker shutdown so buffered messages are not lost.
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        written = self.flush()
+        if written:
+            logger.info(f"Flushed {written} buffered messages on shutdown")
+        with self._lock:
+            rows, self._rows = self._rows, []
+            turns, self._turns = self._turns, []
+        self._spill(rows, turns, reason="shutdown")
+
+
+_message_buffer = None
+
+
+def init_message_buffer(session_factory: Callable[[], Session]) -> MessageWriteBuffer:
+    """
+    Creates the process-wide message write buffer. Called by the Celery app with its sync session factory.
+    """
+    global _message_buffer
+    if _message_buffer is None:
+        _message_buffer = MessageWriteBuffer(
+            session_factory,
+            max_rows=settings.MESSAGE_FLUSH_SIZE,
+            interval_seconds=settings.MESSAGE_FLUSH_INTERVAL_SECONDS,
+            capacity=settings.MESSAGE_BUFFER_MAX_ROWS,
+        )
+    return _message_buffer
+
+
+def pending_messages(chat_history_id: int) -> List[Message]:
+    """
+    Messages of a conversation that this process has buffered but not yet written.
+    """
+    if _message_buffer is None:
+        return []
+    return _message_buffer.pending(chat_history_id)
@@ -0,0 +1,148 @@
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.config import settings
+from app.services.clinic_profile import ClinicProfile
+from app.utils.prompt_builder import build_prompt_from_prefix, build_static_prompt, format_service_line
+from app.utils.tokens import MESSAGE_OVERHEAD_TOKENS, count_tokens, truncate_to_tokens
+
+
+@dataclass
+class PromptBudget:
+    total: int
+    services: int
+    rag: int
+    history: int
+
+    @classmethod
+    def from_settings(cls) -> "PromptBudget":
+        return cls(
+            total=settings.PROMPT_TOKEN_BUDGET,
+            services=settings.PROMPT_SERVICES_TOKEN_BUDGET,
+            rag=settings.PROMPT_RAG_TOKEN_BUDGET,
+            history=settings.PROMPT_HISTORY_TOKEN_BUDGET,
+        )
+
+
+@dataclass
+class AssembledPrompt:
+    messages: List[dict]
+    # Tokens used per section: base, services, rag, history, user, total
+    usage: Dict[str, int] = field(default_factory=dict)
+
+
+@lru_cache(maxsize=1024)
+def _profile_token_counts(profile: ClinicProfile) -> Tuple[int, Tuple[int, ...]]:
+    """
+    Token counts of the base instructions and of each service line, computed once per clinic version.
+    """
+    base = count_tokens(build_static_prompt(replace(profile, services=())))
+    per_service = tuple(count_tokens(format_service_line(s)) + 1 for s in profile.services)
+    return base, per_service
+
+
+def _keep_leading(costs: List[int], budget: int) -> int:
+    """
+    Number of leading items whose costs fit in `budget`.
+    """
+    used = 0
+    for i, cost in enumerate(costs):
+        if used + cost > budget:
+            return i
+        used += cost
+    return len(costs)
+
+
+def _keep_trailing(costs: List[int], budget: int) -> int:
+    """
+    Number of trailing items whose costs fit in `budget`.
+    """
+    return _keep_leading(costs[::-1], budget)
+
+
+def assemble_prompt(
+    profile: ClinicProfile,
+    rag_chunks: List[str],
+    history: List[dict],
+    user_message: str,
+    summary: Optional[str] = None,
+    budget: Optional[PromptBudget] = None,
+) -> AssembledPrompt:
+    """
+    Builds the chat messages for a turn within a token budget.
+
+    Each section is first fitted to its own budget. If the whole prompt is still over
+    the total budget, sections are trimmed by priority: history first (oldest messages),
+    then RAG context (lowest-ranked chunks), then the service list.
+    """
+    budget = budget or PromptBudget.from_settings()
+    base_tokens, service_costs = _profile_token_counts(profile)
+    user_tokens = count_tokens(user_message) + MESSAGE_OVERHEAD_TOKENS
+
+    summary_message = None
+    summary_tokens = 0
+    if summary:
+        summary_text = truncate_to_tokens(summary, budget.history // 2)
+        summary_message = {"role": "system", "content": f"Summary of the earlier conversation with this customer:\n{summary_text}"}
+        summary_tokens = count_tokens(summary_message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    # RAG chunks are ranked by relevance; a chunk that is too large on its own is truncated.
+    chunks = list(rag_chunks)
+    if chunks and count_tokens(chunks[0]) > budget.rag:
+        chunks[0] = truncate_to_tokens(chunks[0], budget.rag)
+    chunk_costs = [count_tokens(c) + 1 for c in chunks]
+    history_costs = [count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in history]
+
+    # 1. Fit each section to its own budget.
+    service_count = _keep_leading(list(service_costs), budget.services)
+    chunk_count = _keep_leading(chunk_costs, budget.rag)
+    history_count = _keep_trailing(history_costs, budget.history - summary_tokens)
+
+    # 2. Trim by priority until the whole prompt fits the total budget.
+    fixed = base_tokens + MESSAGE_OVERHEAD_TOKENS + summary_tokens + user_tokens
+    services_used = sum(service_costs[:service_count])
+    rag_used = sum(chunk_costs[:chunk_count])
+    history_used = sum(history_costs[len(history_costs) - history_count:])
+    overflow = fixed + services_used + rag_used + history_used - budget.total
+    while overflow > 0 and history_count:
+        overflow -= history_costs[len(history_costs) - history_count]
+        history_count -= 1
+    while overflow > 0 and chunk_count:
+        chunk_count -= 1
+        overflow -= chunk_costs[chunk_count]
+    while overflow > 0 and service_count:
+        service_count -= 1
+        overflow -= service_costs[service_count]
+
+    if service_count == len(profile.services):
+        # Untrimmed: reuse the cached, byte-identical prefix.
+        prefix = profile.system_prefix
+    else:
+        prefix = build_static_prompt(replace(profile, services=profile.services[:service_count]))
+    chunks = chunks[:chunk_count]
+    system_prompt = build_prompt_from_prefix(prefix, "\n".join(chunks))
+    kept_history = history[len(history) - history_count:] if history_count else []
+
+    messages = [{"role": "system", "content": system_prompt}]
+    if summary_message:
+        messages.append(summary_message)
+    messages.extend(kept_history)
+    messages.append({"role": "user", "content": user_message})
+
+    usage = {
+        "base": base_tokens,
+        "services": sum(service_costs[:service_count]),
+        "rag": sum(chunk_costs[:chunk_count]),
+        "history": summary_tokens + sum(history_costs[len(history_costs) - history_count:]),
+        "user": user_tokens,
+    }
+    usage["total"] = count_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS + usage["history"] + user_tokens
+    if service_count < len(profile.services) or chunk_count < len(rag_chunks) or history_count < len(history):
+        logger.info(
+            f"Trimmed prompt for clinic {profile.id}: {service_count}/{len(profile.services)} services, "
+            f"{chunk_count}/{len(rag_chunks)} RAG chunks, {history_count}/{len(history)} history messages"
+        )
+    return AssembledPrompt(messages=messages, usage=usage)
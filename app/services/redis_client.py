@@ -0,0 +1,31 @@
+import redis
+import redis.asyncio
+from loguru import logger
+
+from app.config import settings
+
+# Shared Redis connection pool for application-level caches.
+# The pool is created lazily, so importing this module never opens a connection.
+_redis_client = None
+_async_redis_client = None
+
+
+def get_redis() -> redis.Redis:
+    """
+    Returns the process-wide synchronous Redis client.
+    """
+    global _redis_client
+    if _redis_client is None:
+        logger.info("Creating Redis client for application caches.")
+        _redis_client = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=1.0)
+    return _redis_client
+
+
+def get_async_redis() -> redis.asyncio.Redis:
+    """
+    Returns the process-wide asyncio Redis client, for use on the API event loop.
+    """
+    global _async_redis_client
+    if _async_redis_client is None:
+        _async_redis_client = redis.asyncio.Redis.from_url(settings.REDIS_URL, socket_timeout=1.0)
+    return _async_redis_client
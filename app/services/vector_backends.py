@@ -0,0 +1,303 @@
+import fcntl
+import json
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+
+from app.config import settings
+
+# A vector as accepted by `upsert`: (id, embedding, metadata)
+Vector = Tuple[str, Sequence[float], dict]
+
+
+@dataclass
+class VectorMatch:
+    id: str
+    score: float
+    metadata: dict = field(default_factory=dict)
+
+
+class VectorStoreBackend(ABC):
+    """
+    Minimal interface the application needs from a vector index.
+    Every operation is scoped to a namespace (one per clinic).
+    """
+
+    @abstractmethod
+    def upsert(self, vectors: List[Vector], namespace: str) -> None:
+        ...
+
+    @abstractmethod
+    def query(self, vector: Sequence[float], top_k: int, namespace: str) -> List[VectorMatch]:
+        ...
+
+    @abstractmethod
+    def delete(self, ids: List[str], namespace: str) -> None:
+        ...
+
+
+class PineconeBackend(VectorStoreBackend):
+    """
+    Hosted Pinecone index.
+    """
+
+    def __init__(self, index_name: str, dimension: int):
+        import pinecone
+
+        pinecone.init(api_key=settings.PINECONE_API_KEY, environment=settings.PINECONE_ENVIRONMENT)
+        if index_name not in pinecone.list_indexes():
+            logger.info(f"Creating Pinecone index: {index_name}")
+            pinecone.create_index(
+                name=index_name,
+                dimension=dimension,
+                metric="cosine",
+                pod_type="p1.x1" # Choose a pod type suitable for your needs
+            )
+        self.index = pinecone.Index(index_name)
+
+    def upsert(self, vectors: List[Vector], namespace: str) -> None:
+        self.index.upsert(vectors=vectors, namespace=namespace)
+
+    def query(self, vector: Sequence[float], top_k: int, namespace: str) -> List[VectorMatch]:
+        results = self.index.query(
+            vector=list(vector),
+            top_k=top_k,
+            namespace=namespace,
+            include_metadata=True,
+        )
+        return [VectorMatch(id=m.id, score=m.score, metadata=m.metadata or {}) for m in results.matches]
+
+    def delete(self, ids: List[str], namespace: str) -> None:
+        if ids:
+            self.index.delete(ids=ids, namespace=namespace)
+
+
+class _LocalNamespace:
+    """
+    Snapshot of one namespace: row-normalized float32 matrix plus ids/metadata.
+    Never modified once published; writers build a new snapshot and swap it in, so a
+    query can keep using the snapshot it started with without holding a lock.
+    """
+
+    def __init__(self, dimension: int, matrix=None, ids=None, metadata=None, generation: int = 0):
+        self.matrix = matrix if matrix is not None else np.empty((0, dimension), dtype=np.float32)
+        self.ids: List[str] = ids if ids is not None else []
+        self.metadata: List[dict] = metadata if metadata is not None else []
+        self.rows: Dict[str, int] = {vector_id: row for row, vector_id in enumerate(self.ids)}
+        self.generation = generation
+        self.stamp = None  # Identity of the metadata file this snapshot was loaded from or saved as
+
+
+class NumpyBackend(VectorStoreBackend):
+    """
+    In-process vector index backed by NumPy.
+
+    Each namespace is stored as a contiguous float32 matrix of unit-normalized rows,
+    persisted to a memory-mapped file, so a top-k cosine query is one matrix-vector
+    product. Files are written under a new generation name and swapped in via the
+    metadata file, which lets other processes pick up changes by checking its identity.
+
+    Every write rewrites the namespace's matrix and metadata, so it costs O(namespace
+    size), and ingesting N chunks in pages of P costs O(N^2 / P). That is fine for a
+    clinic's document set; use Pinecone for large namespaces. Writers are serialized
+    across threads and processes (an flock on the namespace's lock file) and re-read the
+    namespace under the lock, so concurrent writers don't overwrite each other's updates.
+    """
+
+    def __init__(self, directory: str, dimension: int):
+        self.directory = directory
+        self.dimension = dimension
+        self._namespaces: Dict[str, _LocalNamespace] = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    # --- Persistence ---
+
+    def _meta_path(self, namespace: str) -> str:
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", namespace)
+        return os.path.join(self.directory, f"{safe}.json")
+
+    def _matrix_path(self, namespace: str, generation: int) -> str:
+        return self._meta_path(namespace)[:-len(".json")] + f".{generation}.f32"
+
+    @staticmethod
+    def _stamp(path: str):
+        # The metadata file is replaced on every save, so a new inode or mtime means new data.
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def _read(self, namespace: str) -> _LocalNamespace:
+        meta_path = self._meta_path(namespace)
+        stamp = self._stamp(meta_path)
+        if stamp is None:
+            return _LocalNamespace(self.dimension)
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        matrix = None
+        if meta["ids"]:
+            matrix = np.memmap(
+                self._matrix_path(namespace, meta["generation"]),
+                dtype=np.float32,
+                mode="r",
+                shape=(len(meta["ids"]), self.dimension),
+            )
+        ns = _LocalNamespace(self.dimension, matrix, meta["ids"], meta["metadata"], meta["generation"])
+        ns.stamp = stamp
+        return ns
+
+    def _load(self, namespace: str) -> _LocalNamespace:
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+        if ns is not None and ns.stamp == self._stamp(self._meta_path(namespace)):
+            return ns
+        for attempt in range(3):
+            try:
+                ns = self._read(namespace)
+                break
+            except FileNotFoundError:
+                # A writer replaced the generation between reading the metadata and mapping
+                # its matrix; the metadata now points at the newer one.
+                if attempt == 2:
+                    raise
+        with self._lock:
+            self._namespaces[namespace] = ns
+        return ns
+
+    @contextmanager
+    def _writing(self, namespace: str):
+        """
+        Holds the namespace's write lock, across threads and processes.
+        """
+        with self._write_lock, open(self._meta_path(namespace)[:-len(".json")] + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _publish(self, namespace: str, old: _LocalNamespace, ns: _LocalNamespace):
+        """
+        Writes a new snapshot (generation old + 1) and makes it current. Called under `_writing`.
+        """
+        ns.generation = old.generation + 1
+        matrix_path = self._matrix_path(namespace, ns.generation)
+        np.ascontiguousarray(ns.matrix, dtype=np.float32).tofile(matrix_path)
+
+        meta_path = self._meta_path(namespace)
+        tmp_path = f"{meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"generation": ns.generation, "ids": ns.ids, "metadata": ns.metadata}, f)
+        os.replace(tmp_path, meta_path)
+        ns.stamp = self._stamp(meta_path)
+        with self._lock:
+            self._namespaces[namespace] = ns
+
+        # Readers that still map the old file keep a valid view until they reload.
+        try:
+            os.remove(self._matrix_path(namespace, old.generation))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    # --- VectorStoreBackend ---
+
+    def upsert(self, vectors: List[Vector], namespace: str) -> None:
+        if not vectors:
+            return
+        with self._writing(namespace):
+            old = self._load(namespace)
+            matrix = np.array(old.matrix, dtype=np.float32)  # writable copy of the mapped rows
+            ids, metadata, rows = list(old.ids), list(old.metadata), dict(old.rows)
+            incoming = self._normalize(np.asarray([v[1] for v in vectors], dtype=np.float32))
+
+            new_rows = []
+            for (vector_id, _, vector_metadata), row_vector in zip(vectors, incoming):
+                row = rows.get(vector_id)
+                if row is None:
+                    rows[vector_id] = len(ids)
+                    ids.append(vector_id)
+                    metadata.append(vector_metadata or {})
+                    new_rows.append(row_vector)
+                elif row < len(matrix):
+                    matrix[row] = row_vector
+                    metadata[row] = vector_metadata or {}
+                else:
+                    # Duplicate id within the same batch: overwrite the pending row.
+                    new_rows[row - len(matrix)] = row_vector
+                    metadata[row] = vector_metadata or {}
+            if new_rows:
+                matrix = np.vstack([matrix, np.asarray(new_rows, dtype=np.float32)])
+            self._publish(namespace, old, _LocalNamespace(self.dimension, matrix, ids, metadata))
+
+    def query(self, vector: Sequence[float], top_k: int, namespace: str) -> List[VectorMatch]:
+        ns = self._load(namespace)  # An immutable snapshot; no lock needed while scoring
+        if not ns.ids or top_k <= 0:
+            return []
+
+        q = self._normalize(np.asarray(vector, dtype=np.float32))
+        scores = ns.matrix @ q
+        k = min(top_k, len(ns.ids))
+        if k < len(ns.ids):
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+        else:
+            top = np.argsort(-scores)
+        return [VectorMatch(id=ns.ids[i], score=float(scores[i]), metadata=ns.metadata[i]) for i in top]
+
+    def delete(self, ids: List[str], namespace: str) -> None:
+        if not ids:
+            return
+        with self._writing(namespace):
+            old = self._load(namespace)
+            remove = {old.rows[i] for i in ids if i in old.rows}
+            if not remove:
+                return
+            keep = [row for row in range(len(old.ids)) if row not in remove]
+            self._publish(namespace, old, _LocalNamespace(
+                self.dimension,
+                np.array(old.matrix[keep], dtype=np.float32),
+                [old.ids[row] for row in keep],
+                [old.metadata[row] for row in keep],
+            ))
+
+
+_backend: Optional[VectorStoreBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_vector_backend() -> VectorStoreBackend:
+    """
+    Returns the configured vector store backend (`VECTOR_BACKEND` = "pinecone" or "numpy"),
+    creating it on first use. Creating the Pinecone backend talks to the Pinecone API.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend()
+    return _backend
+
+
+def _create_backend() -> VectorStoreBackend:
+    if settings.VECTOR_BACKEND == "numpy":
+        logger.info(f"Using local NumPy vector index at {settings.LOCAL_VECTOR_DIR}")
+        return NumpyBackend(settings.LOCAL_VECTOR_DIR, settings.EMBEDDING_DIMENSION)
+    if settings.VECTOR_BACKEND == "pinecone":
+        return PineconeBackend(settings.PINECONE_INDEX_NAME, settings.EMBEDDING_DIMENSION)
+    raise ValueError(f"Unknown VECTOR_BACKEND: {settings.VECTOR_BACKEND}")
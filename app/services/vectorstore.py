@@ -1,73 +1,201 @@
-import pinecone
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import OpenAIEmbeddings
+import hashlib
+import threading
+from typing import Callable, Iterable, Iterator, List, Optional, Set
+
 from loguru import logger
 
 from app.config import settings
+from app.services.embedding_cache import query_embedding_cache
+from app.services.ingestion import IngestionPipeline, IngestionStats, iter_split_text
+from app.services.vector_backends import get_vector_backend
+from app.services.metrics import track_stage
+from app.utils.concurrency import run_blocking
 
-# Initialize Pinecone
-pinecone.init(api_key=settings.PINECONE_API_KEY, environment=settings.PINECONE_ENVIRONMENT)
-INDEX_NAME = "clinic-assistant-index"
-
-# Initialize Embeddings model from LangChain
-embeddings = OpenAIEmbeddings(openai_api_key=settings.OPENAI_API_KEY, model=settings.EMBEDDING_MODEL)
-
-def get_or_create_pinecone_index():
-    if INDEX_NAME not in pinecone.list_indexes():
-        logger.info(f"Creating Pinecone index: {INDEX_NAME}")
-        pinecone.create_index(
-            name=INDEX_NAME,
-            dimension=1536, # Dimension for text-embedding-3-small
-            metric="cosine",
-            pod_type="p1.x1" # Choose a pod type suitable for your needs
-        )
-    return pinecone.Index(INDEX_NAME)
+# The embeddings client (and langchain itself, which is slow to import) is created on
+# first use, as is the vector index backend (Pinecone or the local NumPy index, see
+# VECTOR_BACKEND), so importing this module needs neither time nor network access.
+# The API warms both up in the background at startup (see app/services/warmup.py).
+_embeddings = None
+_embeddings_lock = threading.Lock()
 
-index = get_or_create_pinecone_index()
+def get_embeddings():
+    """
+    Returns the process-wide LangChain embeddings client, creating it on first use.
+    """
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                from langchain.embeddings import OpenAIEmbeddings
+                _embeddings = OpenAIEmbeddings(openai_api_key=settings.OPENAI_API_KEY, model=settings.EMBEDDING_MODEL)
+    return _embeddings
 
-def embed_and_store_document(content: str, filename: str, clinic_id: int):
+def embed_query(query: str) -> list:
+    """
+    Embeds a user query, going through the query-embedding cache when enabled.
     """
-    Chunks, embeds, and stores a document in Pinecone.
+    embeddings = get_embeddings()
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return embeddings.embed_query(query)
+    return query_embedding_cache.get_or_compute(query, embeddings.embed_query)
+
+def embed_and_store_document(content: str, filename: str, clinic_id: int, on_progress=None) -> Optional[IngestionStats]:
+    """
+    Chunks, embeds, and stores a document in the vector index.
     This is designed to be run in a background task.
     """
+    return embed_and_store_text_stream([content], filename, clinic_id, on_progress)
+
+def chunk_hash(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:32]
+
+def chunk_vector_id(clinic_id: int, filename: str, digest: str) -> str:
+    # Content-addressed, so an edit elsewhere in the document doesn't change a chunk's ID
+    return f"clinic_{clinic_id}::doc_{filename}::{digest}"
+
+# Documents indexed before chunk manifests existed have positional vector IDs
+# (chunk_0, chunk_1, ...). They are deleted when such a document is first indexed with a
+# manifest. Their count isn't recorded, so a range is cleared that covers a previous
+# version up to twice the size of the new one (and at least this many chunks).
+LEGACY_CHUNK_ID_MIN_RANGE = 1000
+
+def legacy_chunk_vector_ids(clinic_id: int, filename: str, count: int) -> List[str]:
+    return [f"clinic_{clinic_id}::doc_{filename}::chunk_{i}" for i in range(count)]
+
+def embed_and_store_text_stream(
+    pieces: Iterable[str],
+    filename: str,
+    clinic_id: int,
+    on_progress=None,
+    known_hashes: Optional[Set[str]] = None,
+    on_page: Optional[Callable[[List[str]], None]] = None,
+) -> Optional[IngestionStats]:
+    """
+    Chunks, embeds, and stores a document whose text arrives in `pieces` (e.g. read from
+    storage), without ever holding the whole text: it is split incrementally and chunks
+    are embedded in concurrent batches and upserted in fixed-size pages as they finish.
+
+    `known_hashes` is the manifest of the previously indexed version of the document:
+    chunks listed there already have vectors and are not embedded again, and vectors of
+    chunks that are no longer in the document are deleted. The new manifest is returned
+    in `stats.chunk_hashes`. Without a manifest, the positional vector IDs of a version
+    indexed before manifests existed are deleted instead.
+
+    `on_page` is called with the chunk texts of every page once it has been upserted,
+    and with the reused chunks (whose vectors already exist) in pages of the same size.
+    """
     logger.info(f"Processing document '{filename}' for clinic {clinic_id}")
+    namespace = f"clinic-{clinic_id}"
+    known_hashes = known_hashes or set()
+    seen_hashes: Set[str] = set()
+    reused: List[str] = []
+    reused_count = 0
+
+    def report_reused():
+        if on_page and reused:
+            on_page(list(reused))
+        reused.clear()
+
+    def new_chunks(chunks: Iterable[str]) -> Iterator[str]:
+        nonlocal reused_count
+        for chunk in chunks:
+            digest = chunk_hash(chunk)
+            if digest in seen_hashes:
+                continue  # repeated text within the document shares one vector
+            seen_hashes.add(digest)
+            if digest in known_hashes:
+                reused_count += 1
+                reused.append(chunk)
+                if len(reused) >= settings.INGEST_UPSERT_PAGE_SIZE:
+                    report_reused()
+                continue
+            yield chunk
+
+    def make_vector(i: int, chunk: str, embedding: list):
+        vector_id = chunk_vector_id(clinic_id, filename, chunk_hash(chunk))
+        # Store clinic_id in metadata for filtering
+        metadata = {"text": chunk, "clinic_id": clinic_id, "source": filename}
+        return (vector_id, embedding, metadata)
+
+    def upsert_page(page):
+        vector_backend.upsert(page, namespace)
+        if on_page:
+            on_page([metadata["text"] for _, _, metadata in page])
+
     try:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        vector_backend = get_vector_backend()
         text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-        chunks = text_splitter.split_text(content)
-        
-        vectors = []
-        for i, chunk in enumerate(chunks):
-            embedding = embeddings.embed_query(chunk)
-            # Create a unique and descriptive ID for each vector
-            vector_id = f"clinic_{clinic_id}::doc_{filename}::chunk_{i}"
-            # Store clinic_id in metadata for filtering
-            metadata = {"text": chunk, "clinic_id": clinic_id, "source": filename}
-            vectors.append((vector_id, embedding, metadata))
-
-        if vectors:
-            index.upsert(vectors=vectors, namespace=f"clinic-{clinic_id}")
-            logger.info(f"Successfully stored {len(vectors)} vectors for document '{filename}' in namespace clinic-{clinic_id}.")
+        chunks = iter_split_text(pieces, text_splitter.split_text)
+
+        pipeline = IngestionPipeline(
+            embed_batch=get_embeddings().embed_documents,
+            upsert_page=upsert_page,
+            make_vector=make_vector,
+            batch_size=settings.INGEST_BATCH_SIZE,
+            batch_max_chars=settings.INGEST_BATCH_MAX_CHARS,
+            concurrency=settings.INGEST_CONCURRENCY,
+            upsert_page_size=settings.INGEST_UPSERT_PAGE_SIZE,
+            on_progress=on_progress,
+        )
+        stats = pipeline.run(new_chunks(chunks))
+        report_reused()
+        stats.chunks_reused = reused_count
+        stats.chunk_hashes = seen_hashes
+
+        orphans = [chunk_vector_id(clinic_id, filename, digest) for digest in sorted(known_hashes - seen_hashes)]
+        page_size = settings.INGEST_UPSERT_PAGE_SIZE
+        for start in range(0, len(orphans), page_size):
+            vector_backend.delete(orphans[start:start + page_size], namespace)
+        stats.vectors_deleted = len(orphans)
+
+        if not known_hashes:
+            legacy = legacy_chunk_vector_ids(clinic_id, filename, max(2 * len(seen_hashes), LEGACY_CHUNK_ID_MIN_RANGE))
+            for start in range(0, len(legacy), page_size):
+                vector_backend.delete(legacy[start:start + page_size], namespace)
+
+        logger.info(
+            f"Successfully stored {stats.vectors_upserted} vectors for document '{filename}' in namespace {namespace} "
+            f"in {stats.seconds:.2f}s ({stats.chunks_per_second:.1f} chunks/s); "
+            f"{stats.chunks_reused} unchanged chunks reused, {stats.vectors_deleted} stale vectors deleted."
+        )
+        return stats
 
     except Exception as e:
         logger.error(f"Failed to process document for clinic {clinic_id}: {e}")
+        return None
 
-async def query_vectorstore(clinic_id: int, query: str, top_k: int = 3) -> str:
+async def query_vectorstore_chunks(clinic_id: int, query: str, top_k: int = 3, query_embedding: Optional[list] = None) -> List[str]:
     """
     Queries the vector store to find relevant context for a given query,
     searching only within the specific clinic's namespace.
+    Returns the matching chunk texts, most relevant first.
+    Both the embedding and the index lookup are blocking clients, so they run on the
+    bounded executor instead of the event loop.
+    A precomputed `query_embedding` can be passed to skip the embedding step.
     """
     try:
-        query_embedding = embeddings.embed_query(query)
-        results = index.query(
-            vector=query_embedding,
-            top_k=top_k,
-            namespace=f"clinic-{clinic_id}", # Use namespace for multi-tenancy
-            include_metadata=True
-        )
-        
-        context = "\n".join([res.metadata['text'] for res in results.matches])
-        logger.info(f"Retrieved RAG context for clinic {clinic_id}: {context[:200]}...")
-        return context
+        if query_embedding is None:
+            with track_stage("embedding", clinic_id):
+                query_embedding = await run_blocking(embed_query, query)
+        with track_stage("vector_query", clinic_id):
+            matches = await run_blocking(
+                get_vector_backend().query,
+                query_embedding,
+                top_k,
+                f"clinic-{clinic_id}", # Use namespace for multi-tenancy
+            )
+
+        chunks = [m.metadata['text'] for m in matches]
+        logger.info(f"Retrieved {len(chunks)} RAG chunks for clinic {clinic_id}: {' '.join(chunks)[:200]}...")
+        return chunks
     except Exception as e:
-        logger.error(f"Failed to query Pinecone for clinic {clinic_id}: {e}")
-        return ""
\ No newline at end of file
+        logger.error(f"Failed to query the vector store for clinic {clinic_id}: {e}")
+        return []
+
+async def query_vectorstore(clinic_id: int, query: str, top_k: int = 3, query_embedding: Optional[list] = None) -> str:
+    """
+    Same as query_vectorstore_chunks, with the chunks joined into a single context string.
+    """
+    return "\n".join(await query_vectorstore_chunks(clinic_id, query, top_k, query_embedding))
@@ -0,0 +1,54 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+from loguru import logger
+
+from app.config import settings
+from app.services.vector_backends import get_vector_backend
+from app.services.vectorstore import get_embeddings
+from app.services.whatsapp import get_twilio_client
+from app.utils.tokens import get_encoding
+
+# Background warm-up of the lazily created clients.
+# Nothing that needs the network or a slow import runs at import time; instead each
+# process creates its clients concurrently right after startup, off the request path,
+# so the first message doesn't pay for them. A failed step (e.g. no network) is only
+# logged: the client is created again on first use.
+
+
+def _warmup_steps() -> Dict[str, Callable[[], object]]:
+    return {
+        "vector_backend": get_vector_backend,
+        "embeddings": get_embeddings,
+        "twilio": get_twilio_client,
+        "tokenizer": lambda: get_encoding(settings.CHAT_MODEL),
+    }
+
+
+def warm_up_clients() -> Dict[str, float]:
+    """
+    Creates all lazily initialized clients concurrently. Returns the seconds each step
+    took (failed steps are left out).
+    """
+    steps = _warmup_steps()
+    timings: Dict[str, float] = {}
+
+    def run(name: str, step: Callable[[], object]):
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.warning(f"Warm-up of {name} failed, it will be retried on first use: {e}")
+            return
+        timings[name] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(steps), thread_name_prefix="warmup") as executor:
+        for name, step in steps.items():
+            executor.submit(run, name, step)
+    logger.info(
+        f"Clients warmed up in {time.perf_counter() - started:.2f}s "
+        f"({', '.join(f'{name} {seconds:.2f}s' for name, seconds in timings.items())})"
+    )
+    return timings
@@ -1,22 +1,45 @@
-from twilio.rest import Client
+import threading
+from typing import Optional
+
 from loguru import logger
 
 from app.config import settings
+from app.services.metrics import track_stage
+
+# Twilio client, created on first use (see get_twilio_client)
+_twilio_client = None
+_twilio_client_lock = threading.Lock()
 
-# Initialize Twilio Client
-twilio_client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+def get_twilio_client():
+    """
+    Returns the process-wide Twilio client. The twilio package is only imported here,
+    so processes that never send messages don't pay for it.
+    """
+    global _twilio_client
+    if _twilio_client is None:
+        with _twilio_client_lock:
+            if _twilio_client is None:
+                from twilio.rest import Client
+                _twilio_client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+    return _twilio_client
 
-def send_whatsapp_message(to: str, body: str):
+def send_whatsapp_message(to: str, body: str, from_: Optional[str] = None, clinic_id: Optional[int] = None) -> str:
     """
-    Sends a message via the Twilio WhatsApp API.
+    Sends a message via the Twilio WhatsApp API and returns the message SID.
+    `from_` is the clinic's own number; defaults to TWILIO_WHATSAPP_NUMBER.
+    Errors are logged and re-raised so the calling task can retry delivery.
+    `clinic_id` is only used to label the latency metrics.
     """
     try:
         logger.info(f"Sending WhatsApp message to {to}: {body[:100]}...")
-        message = twilio_client.messages.create(
-            from_=settings.TWILIO_WHATSAPP_NUMBER,
-            body=body,
-            to=to
-        )
+        with track_stage("whatsapp_send", clinic_id):
+            message = get_twilio_client().messages.create(
+                from_=from_ or settings.TWILIO_WHATSAPP_NUMBER,
+                body=body,
+                to=to
+            )
         logger.info(f"Message sent successfully. SID: {message.sid}")
+        return message.sid
     except Exception as e:
         logger.error(f"Failed to send WhatsApp message to {to}: {e}")
+        raise
@@ -0,0 +1,8 @@
+def normalize_whatsapp_number(number: str) -> str:
+    """
+    Normalizes provider addresses like "whatsapp:+1 415 523 8886" to "+14155238886".
+    """
+    number = number.strip()
+    if number.lower().startswith("whatsapp:"):
+        number = number[len("whatsapp:"):]
+    return "".join(ch for ch in number if ch.isdigit() or ch == "+")
@@ -1,8 +1,14 @@
 from app.models.clinic import Clinic
 
-def build_prompt(clinic: Clinic, rag_context: str) -> str:
+def format_service_line(service) -> str:
+    return f"- {service.name}: {service.description or 'No description available'}. Price: {service.price or 'Contact for price'}."
+
+def build_static_prompt(clinic: Clinic) -> str:
     """
-    Dynamically builds the system prompt for the AI based on clinic settings and RAG context.
+    Builds the part of the system prompt that only depends on clinic settings and services.
+    It is byte-identical for every message of a clinic version, so it can be cached
+    and benefit from provider-side prompt caching.
+    `clinic` can be the ORM model or any object with the same attributes (e.g. ClinicProfile).
     """
     
     # Base instructions
@@ -17,13 +23,21 @@ Be concise, helpful, and stick to your role. Do not go off-topic or engage in ca
 
     # Add services information if available
     if clinic.services:
-        service_list = "\n".join([f"- {s.name}: {s.description or 'No description available'}. Price: {s.price or 'Contact for price'}." for s in clinic.services])
+        service_list = "\n".join([format_service_line(s) for s in clinic.services])
         prompt += f"""
 
 Here is a list of services offered by the clinic:
 {service_list}
 """
 
+    return prompt
+
+def build_prompt_from_prefix(static_prompt: str, rag_context: str) -> str:
+    """
+    Appends the per-request parts (RAG context and closing instruction) to a static prompt prefix.
+    """
+    prompt = static_prompt
+
     # Add context from the vector database (RAG) if any was found
     if rag_context:
         prompt += f"""
@@ -36,4 +50,10 @@ Here is some additional information from the clinic's documents that might be re
 
     prompt += "\nNow, please respond to the user's message."
     
-    return prompt
\ No newline at end of file
+    return prompt
+
+def build_prompt(clinic: Clinic, rag_context: str) -> str:
+    """
+    Dynamically builds the system prompt for the AI based on clinic settings and RAG context.
+    """
+    return build_prompt_from_prefix(build_static_prompt(clinic), rag_context)
@@ -0,0 +1,25 @@
+import hashlib
+
+from app.utils.phone import normalize_whatsapp_number
+
+
+def jump_consistent_hash(key: int, num_buckets: int) -> int:
+    """
+    Jump consistent hash (Lamping & Veach). Maps a 64-bit key to a bucket so that
+    growing the bucket count from n to n+1 only moves ~1/(n+1) of the keys.
+    """
+    bucket, j = -1, 0
+    while j < num_buckets:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+def conversation_shard(clinic_number: str, customer_number: str, num_shards: int) -> int:
+    """
+    Stable shard index of a (clinic, customer) conversation.
+    """
+    conversation = f"{normalize_whatsapp_number(clinic_number)}:{normalize_whatsapp_number(customer_number)}"
+    key = int.from_bytes(hashlib.sha1(conversation.encode("utf-8")).digest()[:8], "big")
+    return jump_consistent_hash(key, num_shards)
@@ -0,0 +1,38 @@
+from functools import lru_cache
+
+import tiktoken
+
+from app.config import settings
+
+# Fixed per-message overhead of the chat format (role markers, separators).
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=8)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str = None) -> int:
+    """
+    Counts the exact number of tokens `text` takes for the chat model.
+    """
+    if not text:
+        return 0
+    return len(get_encoding(model or settings.CHAT_MODEL).encode(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = None) -> str:
+    """
+    Cuts `text` down to at most `max_tokens` tokens.
+    """
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding(model or settings.CHAT_MODEL)
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
@@ -0,0 +1,226 @@
+"""
+In-process fakes of the external services used on the message hot path
+(OpenAI chat + embeddings, Pinecone, Twilio), with tunable latency.
+
+They replace the clients at the module attributes the application uses, so the
+real pipeline (webhook, Celery task, routing, context building, persistence)
+runs unchanged and only the network calls are simulated.
+"""
+import asyncio
+import hashlib
+import itertools
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+from app.services.vector_backends import NumpyBackend, Vector, VectorMatch
+
+
+@dataclass
+class Latency:
+    """
+    A simulated call latency: `mean_ms` +/- `jitter` (as a fraction of the mean).
+    """
+    mean_ms: float = 0.0
+    jitter: float = 0.2
+
+    def sample(self, rng: random.Random) -> float:
+        if self.mean_ms <= 0:
+            return 0.0
+        return max(0.0, self.mean_ms * (1 + rng.uniform(-self.jitter, self.jitter))) / 1000
+
+
+class _Obj(dict):
+    """
+    Dict with attribute access, shaped like the openai 0.x response objects.
+    """
+    __getattr__ = dict.__getitem__
+
+
+class FakeChatCompletion:
+    """
+    Stand-in for `openai.ChatCompletion.acreate`. The reply length is fixed, the
+    time to first token is `latency` and streamed tokens arrive at `tokens_per_second`.
+    """
+
+    def __init__(self, latency: Latency, completion_tokens: int = 60, tokens_per_second: float = 50.0, seed: int = 0):
+        self.latency = latency
+        self.completion_tokens = completion_tokens
+        self.tokens_per_second = tokens_per_second
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _delay(self) -> float:
+        with self._lock:
+            self.calls += 1
+            return self.latency.sample(self._rng)
+
+    async def acreate(self, model: str, messages: List[dict], stream: bool = False, **kwargs):
+        delay = self._delay()
+        words = [f"word{i}" for i in range(self.completion_tokens)]
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        if stream:
+            return self._stream(delay, words)
+        # Non-streaming calls return after the whole completion has been generated.
+        await asyncio.sleep(delay + self.completion_tokens / self.tokens_per_second)
+        return _Obj(
+            choices=[_Obj(message=_Obj(role="assistant", content=" ".join(words)))],
+            usage=_Obj(prompt_tokens=prompt_tokens, completion_tokens=self.completion_tokens),
+        )
+
+    async def _stream(self, delay: float, words: List[str]):
+        await asyncio.sleep(delay)
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            yield _Obj(choices=[_Obj(delta=_Obj(content=(" " if i else "") + word))])
+
+
+class FakeEmbeddings:
+    """
+    Stand-in for the langchain OpenAIEmbeddings client. Vectors are derived from a
+    hash of the text, so identical texts embed identically (and hit the caches).
+    """
+
+    def __init__(self, dimension: int, latency: Latency, seed: int = 0):
+        self.dimension = dimension
+        self.latency = latency
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+        return np.random.default_rng(seed).standard_normal(self.dimension, dtype=np.float32).tolist()
+
+    def _wait(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency.sample(self._rng)
+        time.sleep(delay)
+
+    def embed_query(self, text: str) -> List[float]:
+        self._wait()
+        return self._vector(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._wait()
+        return [self._vector(text) for text in texts]
+
+
+class FakePineconeBackend(NumpyBackend):
+    """
+    The local NumPy index with Pinecone-like network latency added to every call.
+    """
+
+    def __init__(self, directory: str, dimension: int, latency: Latency, seed: int = 0):
+        super().__init__(directory, dimension)
+        self.latency = latency
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def _wait(self):
+        with self._rng_lock:
+            delay = self.latency.sample(self._rng)
+        time.sleep(delay)
+
+    def upsert(self, vectors: List[Vector], namespace: str) -> None:
+        self._wait()
+        super().upsert(vectors, namespace)
+
+    def query(self, vector: Sequence[float], top_k: int, namespace: str) -> List[VectorMatch]:
+        self._wait()
+        return super().query(vector, top_k, namespace)
+
+    def delete(self, ids: List[str], namespace: str) -> None:
+        self._wait()
+        super().delete(ids, namespace)
+
+
+class _FakeMessages:
+    def __init__(self, client: "FakeTwilioClient"):
+        self._client = client
+
+    def create(self, from_: str, body: str, to: str):
+        return self._client._send(from_, body, to)
+
+
+class FakeTwilioClient:
+    """
+    Stand-in for `twilio.rest.Client`. Every sent message is reported to
+    `on_send(to, body)`; a fraction `error_rate` of sends fails, like a provider error.
+    """
+
+    def __init__(self, latency: Latency, error_rate: float = 0.0, on_send: Optional[Callable[[str, str], None]] = None, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.on_send = on_send
+        self.messages = _FakeMessages(self)
+        self.sent = 0
+        self.failed = 0
+        self._ids = itertools.count(1)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _send(self, from_: str, body: str, to: str):
+        with self._lock:
+            delay = self.latency.sample(self._rng)
+            fail = self._rng.random() < self.error_rate
+        time.sleep(delay)
+        with self._lock:
+            if fail:
+                self.failed += 1
+            else:
+                self.sent += 1
+        if fail:
+            raise RuntimeError("Simulated Twilio error")
+        if self.on_send:
+            self.on_send(to, body)
+        return _Obj(sid=f"SMfake{next(self._ids):012d}")
+
+
+@dataclass
+class InstalledFakes:
+    chat: FakeChatCompletion
+    embeddings: FakeEmbeddings
+    vector_backend: FakePineconeBackend
+    twilio: FakeTwilioClient
+
+
+def install_fakes(
+    vector_dir: str,
+    llm: Latency,
+    embedding: Latency,
+    vector: Latency,
+    twilio: Latency,
+    completion_tokens: int = 60,
+    tokens_per_second: float = 50.0,
+    twilio_error_rate: float = 0.0,
+    on_send: Optional[Callable[[str, str], None]] = None,
+    seed: int = 0,
+) -> InstalledFakes:
+    """
+    Replaces the OpenAI, embedding, vector index and Twilio clients of the
+    application with fakes. Must run before any message is processed.
+    """
+    import openai
+
+    from app.config import settings
+    from app.services import vector_backends, vectorstore, whatsapp
+
+    fakes = InstalledFakes(
+        chat=FakeChatCompletion(llm, completion_tokens, tokens_per_second, seed=seed),
+        embeddings=FakeEmbeddings(settings.EMBEDDING_DIMENSION, embedding, seed=seed + 1),
+        vector_backend=FakePineconeBackend(vector_dir, settings.EMBEDDING_DIMENSION, vector, seed=seed + 2),
+        twilio=FakeTwilioClient(twilio, twilio_error_rate, on_send, seed=seed + 3),
+    )
+    openai.ChatCompletion.acreate = fakes.chat.acreate
+    vectorstore._embeddings = fakes.embeddings
+    vector_backends._backend = fakes.vector_backend
+    whatsapp._twilio_client = fakes.twilio
+    return fakes
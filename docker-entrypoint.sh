@@ -0,0 +1,13 @@
+#!/bin/sh
+# Container entrypoint for the API and the Celery workers.
+# In Prometheus multiprocess mode every process writes its samples to
+# PROMETHEUS_MULTIPROC_DIR. Files left by the previous run of this service belong to
+# dead processes (whose PIDs new processes may reuse), so start from an empty directory.
+set -e
+
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
+exec "$@"
@@ -0,0 +1,8 @@
+# Gunicorn settings, loaded automatically from the working directory.
+# The command line (docker-compose.yml) sets workers, worker class and bind address.
+from app.services.metrics import mark_process_dead
+
+
+def child_exit(server, worker):
+    # Prometheus multiprocess mode: drop the live-gauge samples of the exited worker.
+    mark_process_dead(worker.pid)